@@ -0,0 +1,473 @@
+"""
+Offline microbenchmarks for ticket_bot's hot paths.
+
+Runs against small in-process fakes of the Discord objects the bot touches,
+so no token or network access is needed. Results are written as JSON so runs
+can be compared across commits:
+
+    python benchmarks/bench_hot_paths.py --output bench.json
+    python benchmarks/bench_hot_paths.py --quick --filter transcript
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import ticket_bot  # noqa: E402
+
+# --- Fakes ---
+class FakeHTTP:
+    """Stands in for discord.py's HTTP client: counts requests and optionally adds latency."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+
+    async def request(self, method, route):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+class FakeObject:
+    def __init__(self, id):
+        self.id = id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __eq__(self, other):
+        return isinstance(other, FakeObject) and other.id == self.id
+
+class FakeRole(FakeObject):
+    def __init__(self, id, name="role"):
+        super().__init__(id)
+        self.name = name
+        self.mention = f"<@&{id}>"
+
+class FakeMember(FakeObject):
+    def __init__(self, id, guild=None, name=None, roles=(), bot=False):
+        super().__init__(id)
+        self.guild = guild
+        self.name = name or f"user{id}"
+        self.display_name = self.name
+        self.mention = f"<@{id}>"
+        self.roles = list(roles)
+        self.bot = bot
+
+class FakeAttachment:
+    def __init__(self, url):
+        self.url = url
+
+class FakeMessage(FakeObject):
+    def __init__(self, id, author, content, created_at, attachments=()):
+        super().__init__(id)
+        self.author = author
+        self.content = content
+        self.clean_content = content
+        self.created_at = created_at
+        self.attachments = list(attachments)
+        self.embeds = []
+
+class FakeTextChannel(FakeObject):
+    HISTORY_PAGE = 100  # Messages per history request, as with the real API
+
+    def __init__(self, id, name, guild, category=None):
+        super().__init__(id)
+        self.name = name
+        self.guild = guild
+        self.category = category
+        self.mention = f"<#{id}>"
+        self.messages = []  # Oldest first
+        self.sent = 0
+
+    async def send(self, content=None, **kwargs):
+        await self.guild.http.request("POST", "/channels/{id}/messages")
+        self.sent += 1
+
+    async def history(self, limit=None, after=None, before=None, oldest_first=False):
+        messages = [
+            msg for msg in self.messages
+            if (after is None or msg.id > after.id) and (before is None or msg.id < before.id)
+        ]
+        if not oldest_first:
+            messages.reverse()
+        if limit is not None:
+            messages = messages[:limit]
+        # Like discord.py, fetch page by page until a short page (possibly empty) or the limit;
+        # every fetch is a REST call, including one that finds nothing.
+        position = 0
+        while True:
+            page_size = self.HISTORY_PAGE if limit is None else min(self.HISTORY_PAGE, limit - position)
+            if page_size <= 0:
+                return
+            await self.guild.http.request("GET", "/channels/{id}/messages")
+            page = messages[position:position + page_size]
+            for msg in page:
+                yield msg
+            position += len(page)
+            if len(page) < page_size:
+                return
+
+    async def delete(self, reason=None):
+        await self.guild.http.request("DELETE", "/channels/{id}")
+        self.guild.remove_channel(self)
+
+class FakeCategory(FakeObject):
+    def __init__(self, id, name, guild):
+        super().__init__(id)
+        self.name = name
+        self.guild = guild
+        self.mention = f"<#{id}>"
+        self.channels = []
+
+    async def create_text_channel(self, name, overwrites=None):
+        await self.guild.http.request("POST", "/guilds/{id}/channels")
+        channel = FakeTextChannel(self.guild.next_id(), name, self.guild, category=self)
+        self.channels.append(channel)
+        self.guild.channels_by_id[channel.id] = channel
+        return channel
+
+class FakeGuild(FakeObject):
+    def __init__(self, id, http=None):
+        super().__init__(id)
+        self.http = http or FakeHTTP()
+        self.name = f"guild{id}"
+        self.ids = iter(range(id * 10_000_000 + 1, (id + 1) * 10_000_000))
+        self.default_role = FakeRole(id, "@everyone")
+        self.me = FakeMember(self.next_id(), self, name="ticket-bot", bot=True)
+        self.categories = []
+        self.channels_by_id = {}
+        self.members = {}
+        self.filesize_limit = 25 * 1024 * 1024
+
+    def next_id(self):
+        return next(self.ids)
+
+    @property
+    def channels(self):
+        return list(self.channels_by_id.values())
+
+    def get_channel(self, channel_id):
+        return self.channels_by_id.get(channel_id)
+
+    def get_member(self, user_id):
+        return self.members.get(user_id)
+
+    def get_role(self, role_id):
+        return None
+
+    def add_member(self, name=None):
+        member = FakeMember(self.next_id(), self, name=name)
+        self.members[member.id] = member
+        return member
+
+    def add_text_channel(self, name, category=None):
+        channel = FakeTextChannel(self.next_id(), name, self, category=category)
+        self.channels_by_id[channel.id] = channel
+        if category is not None:
+            category.channels.append(channel)
+        return channel
+
+    def remove_channel(self, channel):
+        self.channels_by_id.pop(channel.id, None)
+        if channel.category is not None:
+            channel.category.channels.remove(channel)
+
+    async def create_category(self, name, overwrites=None):
+        await self.http.request("POST", "/guilds/{id}/channels")
+        category = FakeCategory(self.next_id(), name, self)
+        self.categories.append(category)
+        return category
+
+class FakeLogSink:
+    """Replaces LogSink so log-channel posts and transcript files cost nothing but bookkeeping."""
+
+    def __init__(self):
+        self.posts = 0
+        self.files = 0
+        self.file_bytes = 0
+
+    def post(self, embed=None, content=None):
+        self.posts += 1
+
+    async def post_file(self, file, embed=None, content=None):
+        self.files += 1
+        self.file_bytes += len(file.fp.getbuffer())
+
+# --- Harness ---
+async def reset_bot_state(workdir):
+    """Points the bot at fresh in-memory state, a scratch event log and fake log sink."""
+    await ticket_bot.flush_writes()
+    ticket_bot.TICKETS = {}
+    ticket_bot.OPEN_TICKET_INDEX.clear()
+    ticket_bot.TICKET_CHANNEL_NAMES.clear()
+    ticket_bot.TICKET_NAME_COUNTERS.clear()
+    ticket_bot.TICKET_CATEGORY_RESERVATIONS.clear()
+    ticket_bot.TICKET_CATEGORY_PENDING.clear()
+    ticket_bot.TICKET_CATEGORY_FULL_UNTIL.clear()
+    ticket_bot.ticket_store = ticket_bot.MemoryTicketStore()
+    ticket_bot.ticket_timers = ticket_bot.DeadlineScheduler()
+    ticket_bot.ticket_event_log = ticket_bot.TicketEventLog(os.path.join(workdir, "ticket_logs"))
+    ticket_bot.transcript_archive = None  # Indexing runs on its own thread; keep it out of transcript timings
+    await ticket_bot.load_guild_configs(force=True)
+    sink = FakeLogSink()
+    ticket_bot.DEFAULT_GUILD_CONFIG.log_sink = sink
+    for config in ticket_bot.GUILD_CONFIGS.values():
+        config.log_sink = sink
+    return sink
+
+def populate_tickets(guild, count, category_key="claims"):
+    """Adds count open tickets, each with a live channel, and returns their creators."""
+    creators = []
+    records = []
+    for i in range(count):
+        creator = guild.add_member()
+        channel = guild.add_text_channel(f"{category_key}-{creator.name}")
+        creators.append(creator)
+        records.append(ticket_bot.make_ticket_record(channel.id, creator.id, category=category_key, guild_id=guild.id))
+    ticket_bot.save_tickets(records)
+    return creators
+
+def summarize(name, params, samples, ops_per_run, extra=None):
+    """Builds one JSON result from per-run wall-clock samples in seconds."""
+    result = {
+        "name": name,
+        "params": params,
+        "runs": len(samples),
+        "ops_per_run": ops_per_run,
+        "min_s": min(samples),
+        "median_s": statistics.median(samples),
+        "mean_s": statistics.fmean(samples),
+        "per_op_median_s": statistics.median(samples) / ops_per_run,
+        "ops_per_s": ops_per_run / statistics.median(samples),
+    }
+    if extra:
+        result.update(extra)
+    return result
+
+async def measure(run, runs, setup=None):
+    """Times `await run()` runs times, awaiting setup() untimed before each run."""
+    samples = []
+    for _ in range(runs):
+        if setup is not None:
+            await setup()
+        started = time.perf_counter()
+        await run()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+# --- Benchmarks ---
+async def bench_duplicate_detection(workdir, sizes, runs):
+    results = []
+    for size in sizes:
+        await reset_bot_state(workdir)
+        guild = FakeGuild(1)
+        creators = populate_tickets(guild, size)
+        probes = creators[:: max(1, size // 100)][:100]
+        iterations = 10
+
+        async def run():
+            for _ in range(iterations):
+                for creator in probes:
+                    channel, error = await ticket_bot.create_new_ticket(guild, creator, "claims")
+                    assert channel is None and error
+
+        samples = await measure(run, runs)
+        results.append(summarize("duplicate_detection", {"open_tickets": size}, samples, iterations * len(probes), {"http_requests": guild.http.requests}))
+    return results
+
+async def bench_ticket_create(workdir, sizes, runs):
+    results = []
+    for size in sizes:
+        await reset_bot_state(workdir)
+        guild = FakeGuild(1)
+        populate_tickets(guild, size)
+        per_run = 50
+        requests_before = guild.http.requests
+
+        async def run():
+            for _ in range(per_run):
+                channel, error = await ticket_bot.create_new_ticket(guild, guild.add_member(), "claims")
+                assert channel is not None, error
+
+        samples = await measure(run, runs)
+        requests_per_ticket = (guild.http.requests - requests_before) / (per_run * runs)
+        results.append(summarize("ticket_create", {"open_tickets": size}, samples, per_run, {"http_requests_per_ticket": requests_per_ticket}))
+    return results
+
+async def bench_store(workdir, sizes, runs):
+    results = []
+    for size in sizes:
+        await reset_bot_state(workdir)
+        db_path = os.path.join(workdir, f"bench-{size}.db")
+        ticket_bot.ticket_store = ticket_bot.SQLiteTicketStore(db_path)
+        guild = FakeGuild(1)
+        populate_tickets(guild, size)
+
+        async def save():
+            await ticket_bot.save_ticket_data()
+
+        async def load():
+            await ticket_bot.load_ticket_data()
+            assert len(ticket_bot.TICKETS) == size
+
+        results.append(summarize("save_ticket_data", {"tickets": size}, await measure(save, runs), size))
+        results.append(summarize("load_ticket_data", {"tickets": size}, await measure(load, runs), size))
+        await ticket_bot.run_write(ticket_bot.ticket_store.close)
+    return results
+
+def fill_channel_history(channel, creator, staff, count):
+    started = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    for i in range(count):
+        author = creator if i % 3 else staff
+        attachments = [FakeAttachment(f"https://cdn.example.invalid/attachments/{i}/file.png")] if i % 25 == 0 else ()
+        channel.messages.append(FakeMessage(
+            channel.guild.next_id(), author,
+            f"Message {i}: please check the order status and confirm the details again.",
+            started + datetime.timedelta(seconds=i), attachments
+        ))
+
+async def bench_transcript(workdir, message_counts, runs):
+    results = []
+    for count in message_counts:
+        for source in ("history", "event_log"):
+            sink = await reset_bot_state(workdir)
+            guild = FakeGuild(1)
+            log_channel = guild.add_text_channel("ticket-logs")
+            ticket_bot.DEFAULT_GUILD_CONFIG.log_channel_id = log_channel.id
+            creator = guild.add_member("creator")
+            staff = guild.add_member("staff")
+            channel = guild.add_text_channel("claims-creator")
+            ticket_bot.save_ticket(ticket_bot.make_ticket_record(channel.id, creator.id, category="claims", guild_id=guild.id))
+            fill_channel_history(channel, creator, staff, count)
+            ticket_bot.bot.get_channel = guild.get_channel
+
+            log_template = os.path.join(workdir, f"transcript-{count}.jsonl")
+            if source == "event_log":
+                with open(log_template, 'w', encoding='utf-8') as f:
+                    f.write(json.dumps({"op": "open"}) + "\n")
+                    for msg in channel.messages:
+                        f.write(json.dumps({"op": "message", "entry": ticket_bot.transcript_entry(msg)}) + "\n")
+
+            async def setup():
+                # create_transcript discards the event log once it has been exported
+                await ticket_bot.flush_writes()
+                if source == "event_log":
+                    os.makedirs(ticket_bot.ticket_event_log.directory, exist_ok=True)
+                    shutil.copyfile(log_template, ticket_bot.ticket_event_log.path(channel.id))
+
+            async def run():
+                await ticket_bot.create_transcript(channel, staff)
+
+            requests_before = guild.http.requests
+            samples = await measure(run, runs, setup)
+            results.append(summarize("create_transcript", {"messages": count, "source": source}, samples, count, {
+                "transcript_bytes": sink.file_bytes // runs,
+                "http_requests_per_run": (guild.http.requests - requests_before) / runs,
+            }))
+    return results
+
+async def bench_timers(workdir, sizes, runs):
+    results = []
+    for size in sizes:
+        now = time.time()
+
+        async def schedule():
+            timers = ticket_bot.DeadlineScheduler()
+            for channel_id in range(size):
+                timers.schedule(channel_id, 1, now + 3600 + channel_id)
+
+        timers = ticket_bot.DeadlineScheduler()
+        for channel_id in range(size):
+            timers.schedule(channel_id, 1, now + 3600 + channel_id)
+
+        async def reschedule():
+            # Every ticket sees activity once, pushing its deadline back
+            for channel_id in range(size):
+                timers.schedule(channel_id, 1, time.time() + 7200)
+
+        async def fire():
+            due = ticket_bot.DeadlineScheduler()
+            fired = asyncio.Event()
+            remaining = [size]
+
+            async def callback(channel_id, guild_id):
+                remaining[0] -= 1
+                if not remaining[0]:
+                    fired.set()
+
+            for channel_id in range(size):
+                due.schedule(channel_id, 1, now - 1)
+            due.start(callback)
+            await fired.wait()
+            due.task.cancel()
+
+        results.append(summarize("timer_schedule", {"tickets": size}, await measure(schedule, runs), size))
+        results.append(summarize("timer_reschedule", {"tickets": size}, await measure(reschedule, runs), size))
+        results.append(summarize("timer_fire", {"tickets": size}, await measure(fire, runs), size))
+    return results
+
+BENCHMARKS = {
+    "duplicate_detection": (bench_duplicate_detection, [10, 1_000, 100_000], [10, 1_000]),
+    "ticket_create": (bench_ticket_create, [10, 1_000, 100_000], [10, 1_000]),
+    "store": (bench_store, [1_000, 10_000, 100_000], [1_000]),
+    "transcript": (bench_transcript, [10_000], [1_000]),
+    "timers": (bench_timers, [1_000, 10_000, 100_000], [1_000]),
+}
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def run_benchmarks(names, quick, runs):
+    results = []
+    with tempfile.TemporaryDirectory(prefix="ticket-bot-bench-") as workdir:
+        for name in names:
+            bench, sizes, quick_sizes = BENCHMARKS[name]
+            print(f"running {name}...", file=sys.stderr)
+            results.extend(await bench(workdir, quick_sizes if quick else sizes, runs))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout.")
+    parser.add_argument("--filter", default="", help="Only run benchmarks whose name contains this string.")
+    parser.add_argument("--quick", action="store_true", help="Use small sizes only, for a fast smoke run.")
+    parser.add_argument("--runs", type=int, default=5, help="Timed runs per benchmark (default: 5).")
+    args = parser.parse_args()
+
+    logging.getLogger("ticket_bot").setLevel(logging.ERROR)
+    names = [name for name in BENCHMARKS if args.filter in name]
+    report = {
+        "schema": 1,
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "quick": args.quick,
+        "results": asyncio.run(run_benchmarks(names, args.quick, args.runs)),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
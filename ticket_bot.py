@@ -1,23 +1,82 @@
 import discord
+from discord import app_commands
 from discord.ext import commands
 import asyncio
 import os
 import sys
-import traceback
 import json
+import logging
+import logging.handlers
+import queue
+import atexit
+import copy
+import threading
+import traceback
+import concurrent.futures
+import functools
+import signal
+import sqlite3
+import time
+import heapq
+import itertools
+import io
+import zlib
+import collections
+import math
+import re
+import contextlib
+import hashlib
+import uuid
+import aiohttp
 
 # --- Configuration ---
 # It's highly recommended to use environment variables or a separate config file
 # for sensitive information and configurable parameters in a production environment.
+# The values below are defaults; GUILD_CONFIG_FILE can override them per guild (see GuildConfig).
+GUILD_CONFIG_FILE = os.getenv("GUILD_CONFIG_FILE", "guild_config.json")
+GUILD_CONFIG_RELOAD_INTERVAL = 30  # Seconds between checks of GUILD_CONFIG_FILE for changes
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # Serve Prometheus metrics on this port; 0 disables
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()  # DEBUG adds per-ticket timer and activity messages
+IO_WORKERS = int(os.getenv("IO_WORKERS", "4"))  # Threads for blocking file reads; writes use one ordered thread
+LOOP_LAG_THRESHOLD = float(os.getenv("LOOP_LAG_THRESHOLD", "0.25"))  # Seconds the loop may stall before its stack is logged
+LOOP_LAG_CHECK_INTERVAL = 0.1
+LAZY_MEMBERS = os.getenv("LAZY_MEMBERS", "1") == "1"  # Resolve members on demand instead of chunking every guild at startup
+MEMBER_CACHE_SIZE = 5000  # Members kept by the on-demand member cache
+MEMBER_CACHE_TTL = 600  # Seconds a fetched member is trusted before it is fetched again
+COMMAND_PREFIX = '!'
 STAFF_ROLE_ID = 1376861623834247168
 OWNER_ROLE_ID = 1368395196131442849
 LOG_CHANNEL_ID = 1377208637029744641
+LOG_WEBHOOK_URL = os.getenv("LOG_WEBHOOK_URL")  # Optional webhook into the log channel (separate rate-limit bucket)
+LOG_FLUSH_INTERVAL = 2  # Max seconds a log embed waits to be batched with others
 AUTO_CLOSE_TIME = 1800  # 30 minutes in seconds
+CLOSE_COUNTDOWN = 10  # Seconds between a manual close and channel deletion
+AUTO_CLOSE_DELETE_DELAY = 5  # Seconds between an auto-close notice and channel deletion
+CLOSE_WORKERS = 3  # Concurrent close jobs (transcript export, logging, deletion)
+SHUTDOWN_DRAIN_TIMEOUT = 25  # Seconds close jobs already running get to finish on SIGTERM
+BULK_CLOSE_CONCURRENCY = 5  # Transcript exports and deletions in flight during bulk admin commands
+TRANSCRIPT_PART_LIMIT = 8 * 1024 * 1024  # Max bytes per transcript attachment (the guild's upload limit applies if lower)
+TRANSCRIPT_COMPRESS = os.getenv("TRANSCRIPT_COMPRESS", "0") == "1"  # Attach transcripts as .txt.gz
+TRANSCRIPT_ARCHIVE_FILE = os.getenv("TRANSCRIPT_ARCHIVE_FILE", "transcripts.db")  # Searchable transcript archive; empty disables
+TRANSCRIPT_RETENTION_DAYS = int(os.getenv("TRANSCRIPT_RETENTION_DAYS", "365"))  # 0 keeps archived transcripts forever
+TRANSCRIPT_ARCHIVE_MAINTENANCE_INTERVAL = 6 * 3600  # Seconds between retention and compaction passes
+ATTACHMENT_ARCHIVE_DIR = os.getenv("ATTACHMENT_ARCHIVE_DIR")  # Keep local copies of ticket attachments here; unset disables
+ATTACHMENT_ARCHIVE_BASE_URL = os.getenv("ATTACHMENT_ARCHIVE_BASE_URL")  # Optional URL the archive directory is served under
+ATTACHMENT_MAX_FILE_BYTES = 25 * 1024 * 1024
+ATTACHMENT_MAX_TICKET_BYTES = 200 * 1024 * 1024
+ATTACHMENT_DOWNLOADS = 4  # Concurrent attachment downloads across all tickets
 
 # Persistent storage for active tickets
-TICKET_DATA_FILE = 'ticket_data.json'
-TICKET_CREATOR = {}  # This will be loaded from/saved to TICKET_DATA_FILE
-ticket_timers = {}  # In-memory for active auto-close tasks
+TICKET_STORE_BACKEND = os.getenv("TICKET_STORE_BACKEND", "sqlite")  # See TICKET_STORE_BACKENDS
+TICKET_DB_FILE = 'ticket_data.db'
+TICKET_DATA_FILE = 'ticket_data.json'  # Legacy JSON store, imported once into the ticket store
+TICKET_LOG_DIR = 'ticket_logs'  # Per-ticket append-only message logs used to build transcripts
+TICKETS = {}  # channel_id -> ticket record, mirrored in the ticket store
+OPEN_TICKET_INDEX = {}  # (guild_id, creator_id, category) -> channel_id, derived from TICKETS
+OPEN_TICKET_COUNTS = collections.Counter()  # (guild_id, category) -> open tickets, maintained with the index
+ticket_store = None  # Opened by load_ticket_data()
+startup_complete = False  # Set by the first on_ready; later ones are gateway reconnects
 
 # Define your categories with labels, emojis, and button styles.
 CATEGORIES_DATA = {
@@ -56,60 +115,1447 @@ PAYMENT_METHODS = {
     }
 }
 
+# --- Logging ---
+LOG_CONTEXT_FIELDS = ("ticket_id", "guild_id", "user_id")  # Passed per call via extra={...}
+
+class JsonLogFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, including any ticket/guild/user context."""
+
+    def format(self, record):
+        payload = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in LOG_CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                payload[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            payload["exc"] = record.exc_text
+        if record.stack_info:
+            payload["stack"] = record.stack_info
+        return json.dumps(payload, default=str)
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the writer thread without formatting them on the event loop.
+
+    The stock QueueHandler formats the whole record before enqueueing; here only
+    the message and traceback text are resolved, and the JSON encoding happens
+    on the listener thread.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)  # Other handlers may still see the original
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+log = logging.getLogger("ticket_bot")
+log_listener = None  # QueueListener writing records from a background thread
+
+def setup_logging(level=LOG_LEVEL):
+    """Routes all logging, including discord.py's, through a queue to a background writer thread."""
+    global log_listener
+    if log_listener is not None:
+        return
+    log_queue = queue.SimpleQueue()
+    writer = logging.StreamHandler(sys.stderr)
+    writer.setFormatter(JsonLogFormatter())
+    log_listener = logging.handlers.QueueListener(log_queue, writer, respect_handler_level=True)
+    log_listener.start()
+    atexit.register(log_listener.stop)
+
+    root = logging.getLogger()
+    root.handlers[:] = [StructuredQueueHandler(log_queue)]
+    root.setLevel(level)
+    # discord.py logs every gateway event at DEBUG; keep it at INFO unless asked otherwise
+    logging.getLogger("discord").setLevel(max(root.level, logging.INFO))
+
+# --- Metrics ---
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Metric:
+    """
+    Base class for a Prometheus metric family with optional labels.
+
+    Updates may come from worker threads (e.g. store write timings), so
+    values are only touched under the lock and scrapes render a snapshot.
+    """
+
+    kind = None
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.values = {}  # label values tuple -> sample state
+        self.lock = threading.Lock()
+        METRICS.append(self)
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def format_labels(self, key, extra=None):
+        pairs = list(zip(self.label_names, key)) + (list(extra.items()) if extra else [])
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in pairs) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = list(self.values.items())
+        return [f"{self.name}{self.format_labels(key)} {value}" for key, value in values]
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help_text, label_names=(), function=None):
+        super().__init__(name, help_text, label_names)
+        self.function = function  # Read at scrape time for unlabelled gauges
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def samples(self):
+        if self.function is not None:
+            return [f"{self.name} {self.function()}"]
+        with self.lock:
+            values = list(self.values.items())
+        return [f"{self.name}{self.format_labels(key)} {value}" for key, value in values]
+
+class Histogram(Metric):
+    kind = "histogram"
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observes the wall-clock duration of the with-block, including any awaits inside it."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self.lock:
+            values = [(key, {**state, "counts": list(state["counts"])}) for key, state in self.values.items()]
+        lines = []
+        for key, state in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state["counts"]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{self.format_labels(key, {'le': bound})} {cumulative}")
+            lines.append(f"{self.name}_bucket{self.format_labels(key, {'le': '+Inf'})} {state['count']}")
+            lines.append(f"{self.name}_sum{self.format_labels(key)} {state['sum']}")
+            lines.append(f"{self.name}_count{self.format_labels(key)} {state['count']}")
+        return lines
+
+METRICS = []
+metrics_runner = None  # aiohttp AppRunner serving /metrics, when enabled
+BYTE_BUCKETS = tuple(1024 * 4 ** i for i in range(10))  # 1 KiB .. 256 MiB
+
+TICKET_CREATE_SECONDS = Histogram("ticket_create_seconds", "Time to create a ticket channel, from request to result.")
+CLOSE_PIPELINE_SECONDS = Histogram("ticket_close_pipeline_seconds", "Time from a close request to channel deletion.", ["method"])
+TRANSCRIPT_EXPORT_SECONDS = Histogram("transcript_export_seconds", "Time to export a ticket transcript.")
+TRANSCRIPT_EXPORT_BYTES = Histogram("transcript_export_bytes", "Size of exported transcripts across all parts.", buckets=BYTE_BUCKETS)
+STORE_WRITE_SECONDS = Histogram("ticket_store_write_seconds", "Time spent persisting ticket state.", ["op"])
+DISCORD_REST_SECONDS = Histogram("discord_rest_request_seconds", "Discord REST request latency.", ["method", "route", "status"])
+DISCORD_REST_429_TOTAL = Counter("discord_rest_429_total", "Discord REST responses with status 429.", ["method", "route"])
+EVENT_LOOP_LAG_SECONDS = Gauge("event_loop_lag_seconds", "How late the last event-loop heartbeat woke up.")
+OPEN_TICKETS = Gauge("tickets_open", "Open tickets.", function=lambda: len(TICKETS))
+AUTO_CLOSE_TIMERS = Gauge("auto_close_timers", "Pending auto-close deadlines.", function=lambda: len(ticket_timers))
+
+ROUTE_ID_PATTERN = re.compile(r"/\d{15,21}")
+ROUTE_TOKEN_PATTERN = re.compile(r"/(webhooks|interactions)/\{id\}/[^/]+")
+
+def metrics_route(url):
+    """Collapses snowflakes and tokens in a Discord API URL into a low-cardinality route label."""
+    path = url.path.split("/api/v", 1)[-1]
+    path = path.split("/", 1)[-1] if "/" in path else path
+    path = ROUTE_ID_PATTERN.sub("/{id}", "/" + path)
+    return ROUTE_TOKEN_PATTERN.sub(r"/\1/{id}/{token}", path)
+
+def discord_http_trace():
+    """aiohttp trace hooks that time every Discord REST request and count 429s."""
+    async def on_request_start(session, context, params):
+        context.started = time.perf_counter()
+
+    async def on_request_end(session, context, params):
+        route = metrics_route(params.url)
+        DISCORD_REST_SECONDS.observe(time.perf_counter() - context.started, method=params.method, route=route, status=params.response.status)
+        if params.response.status == 429:
+            DISCORD_REST_429_TOTAL.inc(method=params.method, route=route)
+
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(on_request_start)
+    trace.on_request_end.append(on_request_end)
+    return trace
+
+def render_metrics():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+async def start_metrics_server():
+    """Serves /metrics on METRICS_HOST:METRICS_PORT using the aiohttp that discord.py already depends on."""
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    log.info("Serving metrics on http://%s:%s/metrics", METRICS_HOST, METRICS_PORT)
+    return runner
+
+# --- Blocking I/O ---
+# File and database work never runs on the event loop. Writes (ticket store,
+# event log appends and deletes) go through a single thread so they hit disk
+# in the order they were issued; independent reads use a small bounded pool.
+io_executor = concurrent.futures.ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="ticket-io")
+write_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="ticket-writer")
+
+def log_write_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        log.error("Background write failed", exc_info=future.exception())
+
+def submit_write(func, *args):
+    """Queues a blocking write behind every earlier one. Returns a concurrent.futures.Future."""
+    future = write_executor.submit(func, *args)
+    future.add_done_callback(log_write_failure)
+    return future
+
+async def run_write(func, *args):
+    """Like submit_write(), but waits for the write and returns its result."""
+    return await asyncio.wrap_future(submit_write(func, *args))
+
+async def flush_writes():
+    """Waits until every write queued so far has completed."""
+    await run_write(lambda: None)
+
+async def run_io(func, *args):
+    """Runs a blocking read on the I/O pool and returns its result."""
+    return await asyncio.get_running_loop().run_in_executor(io_executor, func, *args)
+
+class LoopWatchdog:
+    """
+    Detects event-loop stalls from a background thread.
+
+    A loop task stamps a heartbeat every interval. When the watchdog thread sees
+    the heartbeat go stale by more than threshold, the loop is stuck in
+    synchronous code, so it logs the loop thread's current stack (once per stall)
+    to show exactly which call is blocking.
+    """
+
+    def __init__(self, threshold=LOOP_LAG_THRESHOLD, interval=LOOP_LAG_CHECK_INTERVAL):
+        self.threshold = threshold
+        self.interval = interval
+        self.last_beat = time.monotonic()
+        self.loop_thread_id = None
+        self.stall_reported = False
+        self.task = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def start(self):
+        if self.task is not None:
+            return
+        self.loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.task = asyncio.create_task(self.heartbeat())
+        self.thread = threading.Thread(target=self.watch, name="loop-watchdog", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.task is not None:
+            self.task.cancel()
+
+    async def heartbeat(self):
+        while True:
+            started = time.monotonic()
+            self.last_beat = started
+            await asyncio.sleep(self.interval)
+            EVENT_LOOP_LAG_SECONDS.set(max(0.0, time.monotonic() - started - self.interval))
+
+    def watch(self):
+        while not self.stopped.wait(self.interval):
+            stalled_for = time.monotonic() - self.last_beat - self.interval
+            if stalled_for > self.threshold and not self.stall_reported:
+                self.stall_reported = True
+                frame = sys._current_frames().get(self.loop_thread_id)
+                stack = "".join(traceback.format_stack(frame)) if frame is not None else "(stack unavailable)\n"
+                log.warning("Event loop blocked for %.3fs; loop thread stack:\n%s", stalled_for, stack.rstrip())
+            elif stalled_for <= self.threshold and self.stall_reported:
+                self.stall_reported = False
+                log.info("Event loop recovered")
+
+loop_watchdog = LoopWatchdog()
+
 # Bot setup
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True  # Required for fetching members and their roles reliably
-bot = commands.Bot(command_prefix='!', intents=intents)
+bot = commands.Bot(
+    command_prefix=COMMAND_PREFIX,
+    intents=intents,
+    max_messages=None,  # No gateway message cache: ticket messages live in their event logs and edits/deletes use raw events
+    chunk_guilds_at_startup=not LAZY_MEMBERS,  # Lazy mode: members are cached as they appear or via member_cache
+    http_trace=discord_http_trace() if METRICS_PORT else None
+)
+
+# --- Ticket Storage Backends ---
+def make_ticket_record(channel_id, creator_id, category=None, guild_id=None, created_at=None):
+    """Builds a ticket record as kept in TICKETS and the ticket store."""
+    created_at = created_at if created_at is not None else time.time()
+    return {
+        "channel_id": channel_id,
+        "creator_id": creator_id,
+        "category": category,
+        "guild_id": guild_id,
+        "created_at": created_at,
+        "last_activity": created_at
+    }
+
+def make_close_job(channel, closer, method, requested_at=None, closer_is_staff=None):
+    """
+    Builds a close job as kept in CLOSE_JOBS and the ticket store.
+
+    closer_is_staff may be passed when the caller already knows it (bulk
+    closes check the closer once); only staff closes count towards "Busiest Staff".
+    """
+    if closer_is_staff is None:
+        closer_is_staff = method != "auto" and is_staff_or_owner(closer)
+    return {
+        "channel_id": channel.id,
+        "guild_id": channel.guild.id,
+        "closer_id": closer.id,
+        "closer_is_staff": closer_is_staff,
+        "method": method,
+        "stage": "transcript",
+        "delete_at": None,
+        "requested_at": requested_at if requested_at is not None else time.time()
+    }
+
+class TicketStore:
+    """
+    Base class for ticket storage backends.
+
+    Backends persist ticket records one row at a time so a mutation never
+    rewrites the whole data set. They also keep a small key/value table
+    for bookkeeping such as the legacy JSON migration flag.
+    """
+
+    def load_all(self):
+        """Returns a list of every stored ticket record."""
+        raise NotImplementedError
+
+    def upsert(self, record):
+        """Inserts or replaces a single ticket record."""
+        raise NotImplementedError
+
+    def upsert_many(self, records):
+        """Inserts or replaces several ticket records in one transaction."""
+        for record in records:
+            self.upsert(record)
+
+    def delete(self, channel_id):
+        """Deletes the ticket record for channel_id, if any."""
+        raise NotImplementedError
+
+    def delete_many(self, channel_ids):
+        """Deletes several ticket records in one transaction."""
+        for channel_id in channel_ids:
+            self.delete(channel_id)
+
+    def get_meta(self, key, default=None):
+        raise NotImplementedError
+
+    def set_meta(self, key, value):
+        raise NotImplementedError
+
+    def get_meta_prefix(self, prefix):
+        """Returns {key: value} for every meta key starting with prefix."""
+        raise NotImplementedError
+
+    def load_close_jobs(self):
+        """Returns every unfinished close job."""
+        raise NotImplementedError
+
+    def upsert_close_job(self, job):
+        raise NotImplementedError
+
+    def upsert_close_jobs(self, jobs):
+        """Inserts or replaces several close jobs in one transaction."""
+        for job in jobs:
+            self.upsert_close_job(job)
+
+    def delete_close_job(self, channel_id):
+        raise NotImplementedError
+
+    def delete_close_jobs(self, channel_ids):
+        """Deletes several close jobs in one transaction."""
+        for channel_id in channel_ids:
+            self.delete_close_job(channel_id)
+
+    def close(self):
+        pass
+
+class MemoryTicketStore(TicketStore):
+    """Non-persistent backend, useful for development and benchmarks."""
+
+    def __init__(self):
+        self.records = {}
+        self.meta = {}
+        self.close_jobs = {}
+
+    def load_all(self):
+        return [dict(record) for record in self.records.values()]
+
+    def upsert(self, record):
+        self.records[record["channel_id"]] = dict(record)
+
+    def delete(self, channel_id):
+        self.records.pop(channel_id, None)
+
+    def get_meta(self, key, default=None):
+        return self.meta.get(key, default)
+
+    def set_meta(self, key, value):
+        self.meta[key] = value
+
+    def get_meta_prefix(self, prefix):
+        return {key: value for key, value in self.meta.items() if key.startswith(prefix)}
+
+    def load_close_jobs(self):
+        return [dict(job) for job in self.close_jobs.values()]
+
+    def upsert_close_job(self, job):
+        self.close_jobs[job["channel_id"]] = dict(job)
+
+    def delete_close_job(self, channel_id):
+        self.close_jobs.pop(channel_id, None)
+
+class SQLiteTicketStore(TicketStore):
+    """
+    SQLite backend running in WAL mode.
+
+    Every upsert or delete is its own small transaction, so a crash can only
+    lose the mutation in flight instead of truncating the whole store.
+    """
+
+    COLUMNS = ("channel_id", "creator_id", "category", "guild_id", "created_at", "last_activity")
+
+    def __init__(self, path=TICKET_DB_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)  # Only ever used from the writer thread
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS tickets ("
+                "channel_id INTEGER PRIMARY KEY, "
+                "creator_id INTEGER NOT NULL, "
+                "category TEXT, "
+                "guild_id INTEGER, "
+                "created_at REAL NOT NULL, "
+                "last_activity REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS close_jobs (channel_id INTEGER PRIMARY KEY, job TEXT NOT NULL)")
+
+    def load_all(self):
+        rows = self.conn.execute(f"SELECT {', '.join(self.COLUMNS)} FROM tickets").fetchall()
+        return [dict(zip(self.COLUMNS, row)) for row in rows]
+
+    def _upsert_sql(self):
+        placeholders = ", ".join("?" for _ in self.COLUMNS)
+        return f"INSERT OR REPLACE INTO tickets ({', '.join(self.COLUMNS)}) VALUES ({placeholders})"
+
+    def upsert(self, record):
+        with self.conn:
+            self.conn.execute(self._upsert_sql(), tuple(record[col] for col in self.COLUMNS))
+
+    def upsert_many(self, records):
+        with self.conn:
+            self.conn.executemany(self._upsert_sql(), [tuple(record[col] for col in self.COLUMNS) for record in records])
+
+    def delete(self, channel_id):
+        with self.conn:
+            self.conn.execute("DELETE FROM tickets WHERE channel_id = ?", (channel_id,))
+
+    def delete_many(self, channel_ids):
+        with self.conn:
+            self.conn.executemany("DELETE FROM tickets WHERE channel_id = ?", [(channel_id,) for channel_id in channel_ids])
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key, value):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    def get_meta_prefix(self, prefix):
+        rows = self.conn.execute("SELECT key, value FROM meta WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+        return {key: json.loads(value) for key, value in rows}
+
+    def load_close_jobs(self):
+        return [json.loads(row[0]) for row in self.conn.execute("SELECT job FROM close_jobs")]
+
+    def upsert_close_job(self, job):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO close_jobs (channel_id, job) VALUES (?, ?)", (job["channel_id"], json.dumps(job)))
+
+    def upsert_close_jobs(self, jobs):
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO close_jobs (channel_id, job) VALUES (?, ?)", [(job["channel_id"], json.dumps(job)) for job in jobs])
+
+    def delete_close_job(self, channel_id):
+        with self.conn:
+            self.conn.execute("DELETE FROM close_jobs WHERE channel_id = ?", (channel_id,))
+
+    def delete_close_jobs(self, channel_ids):
+        with self.conn:
+            self.conn.executemany("DELETE FROM close_jobs WHERE channel_id = ?", [(channel_id,) for channel_id in channel_ids])
+
+    def close(self):
+        self.conn.close()
+
+TICKET_STORE_BACKENDS = {
+    "sqlite": SQLiteTicketStore,
+    "memory": MemoryTicketStore
+}
+
+def open_ticket_store(backend=None):
+    """Instantiates the configured ticket storage backend."""
+    backend = backend or TICKET_STORE_BACKEND
+    if backend not in TICKET_STORE_BACKENDS:
+        raise ValueError(f"Unknown ticket store backend '{backend}'. Available: {', '.join(TICKET_STORE_BACKENDS)}")
+    return TICKET_STORE_BACKENDS[backend]()
+
+def migrate_legacy_ticket_data(store):
+    """One-time import of the legacy channel_id -> user_id JSON file into the store."""
+    if store.get_meta("legacy_json_migrated") or not os.path.exists(TICKET_DATA_FILE):
+        return
+    with open(TICKET_DATA_FILE, 'r') as f:
+        try:
+            legacy_data = json.load(f)
+        except json.JSONDecodeError:
+            log.error("Error decoding %s, skipping migration.", TICKET_DATA_FILE)
+            legacy_data = {}
+    # Category and guild are unknown in the legacy format; on_ready fills them in.
+    records = [make_ticket_record(int(channel_id), int(creator_id)) for channel_id, creator_id in legacy_data.items()]
+    store.upsert_many(records)
+    store.set_meta("legacy_json_migrated", True)
+    os.replace(TICKET_DATA_FILE, TICKET_DATA_FILE + '.migrated')
+    log.info("Migrated %d tickets from %s into the ticket store.", len(records), TICKET_DATA_FILE)
 
 # --- Helper Functions for Persistence ---
-def load_ticket_data():
-    """Loads ticket data from the JSON file into TICKET_CREATOR."""
-    global TICKET_CREATOR
-    if os.path.exists(TICKET_DATA_FILE):
-        with open(TICKET_DATA_FILE, 'r') as f:
+# Store calls run on the writer thread. Callers update TICKETS and the index
+# synchronously and hand the store a copy of each record, so the loop never
+# waits on disk and the thread never sees a record mid-update.
+def store_write(op, method, *args):
+    """Queues a ticket store call on the writer thread, timed under STORE_WRITE_SECONDS{op}."""
+    def write():
+        with STORE_WRITE_SECONDS.time(op=op):
+            return method(*args)
+    return submit_write(write)
+
+async def load_ticket_data():
+    """Opens the ticket store and loads every ticket record into TICKETS."""
+    global TICKETS, ticket_store
+    if ticket_store is None:
+        ticket_store = await run_write(open_ticket_store)
+        await run_write(migrate_legacy_ticket_data, ticket_store)
+    TICKETS = {record["channel_id"]: record for record in await run_write(ticket_store.load_all)}
+    OPEN_TICKET_INDEX.clear()
+    OPEN_TICKET_COUNTS.clear()
+    for record in TICKETS.values():
+        index_ticket(record)
+    log.info("Loaded %d tickets from the ticket store.", len(TICKETS))
+
+async def save_ticket_data():
+    """Writes every ticket record in TICKETS to the store in a single transaction."""
+    await asyncio.wrap_future(store_write("save_all", ticket_store.upsert_many, [dict(record) for record in TICKETS.values()]))
+
+def ticket_index_key(record):
+    """Returns the OPEN_TICKET_INDEX key for a record, or None if it cannot be indexed yet."""
+    if record["guild_id"] is None or record["category"] is None:
+        return None
+    return (record["guild_id"], record["creator_id"], record["category"])
+
+def index_ticket(record):
+    key = ticket_index_key(record)
+    if key is not None:
+        if key not in OPEN_TICKET_INDEX:
+            OPEN_TICKET_COUNTS[(record["guild_id"], record["category"])] += 1
+        OPEN_TICKET_INDEX[key] = record["channel_id"]
+
+def unindex_ticket(record):
+    key = ticket_index_key(record)
+    if key is not None and OPEN_TICKET_INDEX.get(key) == record["channel_id"]:
+        del OPEN_TICKET_INDEX[key]
+        OPEN_TICKET_COUNTS[(record["guild_id"], record["category"])] -= 1
+
+def save_ticket(record):
+    """Adds or updates a single ticket, in memory, in the index and in the store."""
+    previous = TICKETS.get(record["channel_id"])
+    if previous is not None:
+        unindex_ticket(previous)
+    TICKETS[record["channel_id"]] = record
+    index_ticket(record)
+    store_write("upsert", ticket_store.upsert, dict(record))
+
+def save_tickets(records):
+    """Adds or updates several tickets with a single store transaction."""
+    for record in records:
+        previous = TICKETS.get(record["channel_id"])
+        if previous is not None:
+            unindex_ticket(previous)
+        TICKETS[record["channel_id"]] = record
+        index_ticket(record)
+    store_write("upsert_many", ticket_store.upsert_many, [dict(record) for record in records])
+
+def remove_tickets(channel_ids):
+    """Removes several tickets with a single store transaction. Returns the records that existed."""
+    removed = []
+    for channel_id in channel_ids:
+        record = TICKETS.pop(channel_id, None)
+        if record is not None:
+            unindex_ticket(record)
+            removed.append(record)
+    store_write("delete_many", ticket_store.delete_many, list(channel_ids))
+    return removed
+
+def remove_ticket(channel_id):
+    """Removes a single ticket, in memory, in the index and in the store. Returns its record or None."""
+    record = TICKETS.pop(channel_id, None)
+    if record is not None:
+        unindex_ticket(record)
+        store_write("delete", ticket_store.delete, channel_id)
+    return record
+
+def get_ticket_creator_id(channel_id):
+    """Returns the creator's user ID for a ticket channel, or None."""
+    record = TICKETS.get(channel_id)
+    return record["creator_id"] if record else None
+
+# --- Ticket Event Log ---
+class TicketEventLog:
+    """
+    Append-only, per-ticket log of message events stored as JSON lines.
+
+    Each ticket gets one file in the log directory. Events are
+    {"op": "open"}, {"op": "resume"}, {"op": "message", "entry": ...},
+    {"op": "edit", "entry": ...}, {"op": "delete", "ids": [...]} and
+    {"op": "archive", "url": ..., "path": ...} for attachments stored by the
+    AttachmentArchiver.
+    """
+
+    READ_BATCH = 1000  # Events read per trip to the I/O pool
+
+    def __init__(self, directory=TICKET_LOG_DIR):
+        self.directory = directory
+        self.directory_ready = False
+
+    def path(self, channel_id):
+        return os.path.join(self.directory, f"{channel_id}.jsonl")
+
+    def append(self, channel_id, event):
+        """Queues an event for channel_id on the writer thread; encoding happens here, so event may change afterwards."""
+        submit_write(self._write, self.path(channel_id), json.dumps(event) + "\n")
+
+    def _write(self, path, line):
+        if not self.directory_ready:
+            os.makedirs(self.directory, exist_ok=True)
+            self.directory_ready = True
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(line)
+
+    async def events(self, channel_id):
+        """Async iterator over read(): waits for queued appends, then reads in batches on the I/O pool."""
+        await flush_writes()
+        events = self.read(channel_id)
+        while True:
+            batch = await run_io(lambda: list(itertools.islice(events, self.READ_BATCH)))
+            if not batch:
+                return
+            for event in batch:
+                yield event
+
+    def read(self, channel_id):
+        """Yields the events logged for channel_id, oldest first. Blocking; use events() on the loop."""
+        try:
+            f = open(self.path(channel_id), 'r', encoding='utf-8')
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Torn final line after a crash
+
+    def discard(self, channel_id):
+        """Queues removal of channel_id's log behind any pending appends to it."""
+        submit_write(self._remove, self.path(channel_id))
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+ticket_event_log = TicketEventLog()
+
+# --- Attachment Archive ---
+class AttachmentArchiver:
+    """
+    Downloads ticket attachments into a content-addressed directory as they are posted.
+
+    Files are stored as <directory>/<sha256[:2]>/<sha256><ext>, so an image posted
+    twice is kept once. Downloads share one pooled aiohttp session, run at most
+    `concurrency` at a time and are capped per file and per ticket. Each stored
+    file appends an "archive" event to the ticket's event log, which transcripts
+    use to link the local copy next to the (expiring) CDN URL.
+    """
+
+    CHUNK_SIZE = 256 * 1024
+
+    def __init__(self, directory, max_file_bytes=ATTACHMENT_MAX_FILE_BYTES, max_ticket_bytes=ATTACHMENT_MAX_TICKET_BYTES,
+                 concurrency=ATTACHMENT_DOWNLOADS, base_url=None):
+        self.directory = directory
+        self.max_file_bytes = max_file_bytes
+        self.max_ticket_bytes = max_ticket_bytes
+        self.concurrency = concurrency
+        self.base_url = base_url.rstrip('/') if base_url else None
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.session = None
+        self.ticket_bytes = collections.Counter()  # channel_id -> bytes reserved for that ticket's downloads
+        self.tasks = {}  # channel_id -> pending download tasks; absent once the ticket is closed
+
+    def link(self, relative_path):
+        """Where a transcript should point for a stored file."""
+        if self.base_url:
+            return f"{self.base_url}/{relative_path}"
+        return os.path.join(self.directory, relative_path)
+
+    def get_session(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.concurrency),
+                timeout=aiohttp.ClientTimeout(total=300, sock_read=60)
+            )
+        return self.session
+
+    async def close(self):
+        for channel_id in list(self.tasks):
+            self.forget(channel_id)
+        if self.session is not None:
+            await self.session.close()
+
+    def submit(self, channel_id, attachments):
+        """Starts background downloads for a message's attachments, within the per-ticket cap."""
+        for attachment in attachments:
+            if attachment.size > self.max_file_bytes or self.ticket_bytes[channel_id] + attachment.size > self.max_ticket_bytes:
+                log.info("Not archiving attachment %s: over the size cap.", attachment.filename, extra={"ticket_id": channel_id})
+                continue
+            self.ticket_bytes[channel_id] += attachment.size
+            task = asyncio.create_task(self.archive(channel_id, attachment.url, attachment.filename, attachment.size))
+            pending = self.tasks.setdefault(channel_id, set())
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+
+    def forget(self, channel_id):
+        """Cancels a closed ticket's pending downloads so nothing is logged after its transcript."""
+        for task in self.tasks.pop(channel_id, ()):
+            task.cancel()
+        self.ticket_bytes.pop(channel_id, None)
+
+    async def archive(self, channel_id, url, filename, size):
+        async with self.semaphore:
             try:
-                TICKET_CREATOR = json.load(f)
-                # Convert string keys (channel IDs from JSON) back to int for consistent use
-                TICKET_CREATOR = {int(k): v for k, v in TICKET_CREATOR.items()}
-                print(f"Loaded ticket data: {TICKET_CREATOR}")
-            except json.JSONDecodeError:
-                print("Error decoding ticket_data.json, starting with empty data.")
-                TICKET_CREATOR = {}
-    else:
-        TICKET_CREATOR = {}
+                relative_path = await self.download(url, filename)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.warning("Failed to archive attachment %s", filename, exc_info=True, extra={"ticket_id": channel_id})
+                relative_path = None
+        if relative_path is None:
+            self.ticket_bytes[channel_id] -= size
+        elif channel_id in self.tasks:
+            ticket_event_log.append(channel_id, {"op": "archive", "url": url, "path": relative_path})
+        return relative_path
+
+    async def download(self, url, filename):
+        """Streams url into the archive. Returns the stored path relative to the directory, or None if over the cap."""
+        extension = os.path.splitext(filename)[1].lower()
+        if not re.fullmatch(r"\.[a-z0-9]{1,10}", extension):
+            extension = ""
+        temp_dir = os.path.join(self.directory, "tmp")
+        temp_path = os.path.join(temp_dir, uuid.uuid4().hex)
+        await run_io(functools.partial(os.makedirs, temp_dir, exist_ok=True))
+        f = await run_io(open, temp_path, 'wb')
+        try:
+            hasher = hashlib.sha256()
+            received = 0
+            async with self.get_session().get(url) as response:
+                response.raise_for_status()
+                if (response.content_length or 0) > self.max_file_bytes:
+                    return None
+                async for chunk in response.content.iter_chunked(self.CHUNK_SIZE):
+                    received += len(chunk)
+                    if received > self.max_file_bytes:
+                        return None
+                    hasher.update(chunk)
+                    await run_io(f.write, chunk)
+            await run_io(f.close)
+            digest = hasher.hexdigest()
+            relative_path = f"{digest[:2]}/{digest}{extension}"
+            await run_io(self.store, temp_path, relative_path)
+            return relative_path
+        finally:
+            if not f.closed:
+                await run_io(f.close)
+            await run_io(self.discard_temp, temp_path)
+
+    def store(self, temp_path, relative_path):
+        """Moves a finished download to its content address, keeping the existing copy if there is one."""
+        final_path = os.path.join(self.directory, relative_path)
+        if os.path.exists(final_path):
+            return
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(temp_path, final_path)
+
+    def discard_temp(self, temp_path):
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+
+attachment_archiver = AttachmentArchiver(ATTACHMENT_ARCHIVE_DIR, base_url=ATTACHMENT_ARCHIVE_BASE_URL) if ATTACHMENT_ARCHIVE_DIR else None
+
+# --- Ticket Statistics ---
+class QuantileSketch:
+    """
+    Streaming quantile sketch with bounded relative error (DDSketch-style).
+
+    Values are counted in logarithmically sized buckets, so any quantile is
+    within relative_accuracy of the true value and memory depends only on the
+    range of values seen (a few hundred buckets for seconds up to months),
+    never on how many were added.
+    """
+
+    def __init__(self, relative_accuracy=0.01, buckets=None, zero_count=0):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = collections.Counter({int(index): count for index, count in (buckets or {}).items()})
+        self.zero_count = zero_count  # Values <= 0, which have no logarithm
+        self.count = zero_count + sum(self.buckets.values())
+
+    def add(self, value):
+        if value <= 0:
+            self.zero_count += 1
+        else:
+            self.buckets[math.ceil(math.log(value) / self.log_gamma)] += 1
+        self.count += 1
+
+    def quantile(self, q):
+        """Returns the approximate q-quantile (0 <= q <= 1), or None if the sketch is empty."""
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def to_dict(self):
+        return {"relative_accuracy": self.relative_accuracy, "buckets": dict(self.buckets), "zero_count": self.zero_count}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["relative_accuracy"], data["buckets"], data["zero_count"])
+
+class GuildTicketStats:
+    """
+    Running ticket counters for one guild, updated as tickets open and close.
 
-def save_ticket_data():
-    """Saves current ticket data from TICKET_CREATOR to the JSON file."""
-    with open(TICKET_DATA_FILE, 'w') as f:
-        # Convert int keys (channel IDs) to string for JSON serialization
-        json.dump({str(k): v for k, v in TICKET_CREATOR.items()}, f, indent=4)
-        print(f"Saved ticket data: {TICKET_CREATOR}")
+    Open tickets per category are not stored here; they come from
+    OPEN_TICKET_COUNTS, which is kept in step with TICKETS.
+    """
+
+    HOURLY_WINDOW = 24  # Hours of opened/closed buckets to keep
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.opened_total = data.get("opened_total", 0)
+        self.closed_total = data.get("closed_total", 0)
+        self.closed_by_method = collections.Counter(data.get("closed_by_method", {}))
+        self.closes_by_staff = collections.Counter({int(user_id): count for user_id, count in data.get("closes_by_staff", {}).items()})
+        self.hourly = {int(hour): counts for hour, counts in data.get("hourly", {}).items()}  # hour start -> [opened, closed]
+        self.time_to_close = QuantileSketch.from_dict(data["time_to_close"]) if "time_to_close" in data else QuantileSketch()
+
+    def hour_bucket(self, timestamp):
+        hour = int(timestamp // 3600) * 3600
+        counts = self.hourly.get(hour)
+        if counts is None:
+            counts = self.hourly[hour] = [0, 0]
+            cutoff = hour - (self.HOURLY_WINDOW - 1) * 3600
+            for old_hour in [h for h in self.hourly if h < cutoff]:
+                del self.hourly[old_hour]
+        return counts
+
+    def record_open(self, timestamp):
+        self.opened_total += 1
+        self.hour_bucket(timestamp)[0] += 1
+
+    def record_close(self, timestamp, method, closer_id, opened_at=None, by_staff=False):
+        self.closed_total += 1
+        self.closed_by_method[method] += 1
+        if by_staff:
+            self.closes_by_staff[closer_id] += 1
+        self.hour_bucket(timestamp)[1] += 1
+        if opened_at is not None:
+            self.time_to_close.add(timestamp - opened_at)
+
+    def window_counts(self, now, hours):
+        """Returns (opened, closed) over the last `hours` hour buckets, including the current one."""
+        cutoff = int(now // 3600) * 3600 - (hours - 1) * 3600
+        opened = closed = 0
+        for hour, counts in self.hourly.items():
+            if hour >= cutoff:
+                opened += counts[0]
+                closed += counts[1]
+        return opened, closed
+
+    def to_dict(self):
+        return {
+            "opened_total": self.opened_total,
+            "closed_total": self.closed_total,
+            "closed_by_method": dict(self.closed_by_method),
+            "closes_by_staff": dict(self.closes_by_staff),
+            "hourly": {hour: list(counts) for hour, counts in self.hourly.items()},  # Copies: written on the writer thread
+            "time_to_close": self.time_to_close.to_dict(),
+        }
+
+TICKET_STATS = {}  # guild_id -> GuildTicketStats, persisted as store meta "stats:<guild_id>"
+TICKET_STATS_PREFIX = "stats:"
+
+def ticket_stats_key(guild_id):
+    return f"{TICKET_STATS_PREFIX}{guild_id}"
+
+def get_ticket_stats(guild_id):
+    """Returns a guild's stats. A miss means nothing is stored: load_ticket_stats() ran before the gateway connected."""
+    stats = TICKET_STATS.get(guild_id)
+    if stats is None:
+        stats = TICKET_STATS[guild_id] = GuildTicketStats()
+    return stats
+
+async def load_ticket_stats():
+    """
+    Loads every guild's persisted statistics from the ticket store.
+
+    Runs in setup_hook, before any ticket can open or close, and covers all
+    stored guilds (not just those joined at startup) so a fresh object is
+    never saved over history that was not read.
+    """
+    for key, data in (await run_write(ticket_store.get_meta_prefix, TICKET_STATS_PREFIX)).items():
+        TICKET_STATS[int(key[len(TICKET_STATS_PREFIX):])] = GuildTicketStats(data)
+
+def save_ticket_stats(guild_id):
+    store_write("stats", ticket_store.set_meta, ticket_stats_key(guild_id), get_ticket_stats(guild_id).to_dict())
+
+def record_ticket_opened(record):
+    get_ticket_stats(record["guild_id"]).record_open(record["created_at"])
+    save_ticket_stats(record["guild_id"])
+
+def record_ticket_closed(guild_id, record, job):
+    """Counts a finished close job. record is the removed ticket record, or None if it was already gone."""
+    # Jobs persisted before closer_is_staff existed count every manual closer, as they used to
+    by_staff = job.get("closer_is_staff", job["method"] != "auto")
+    get_ticket_stats(guild_id).record_close(time.time(), job["method"], job["closer_id"], record["created_at"] if record else None, by_staff)
+    save_ticket_stats(guild_id)
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return f"{minutes}m {seconds}s"
+    hours, minutes = divmod(minutes, 60)
+    if hours < 24:
+        return f"{hours}h {minutes}m"
+    days, hours = divmod(hours, 24)
+    return f"{days}d {hours}h"
+
+# --- Auto-Close Scheduler ---
+class DeadlineScheduler:
+    """
+    Holds one auto-close deadline per ticket channel behind a single timer task.
+
+    Deadlines live in a heap. Rescheduling pushes a fresh entry and marks the
+    old one stale, so schedule is O(log n) and cancel is O(1); stale entries
+    are skipped when they reach the top and the heap is compacted once they
+    outnumber the live ones. The runner task only wakes when the earliest
+    deadline is due or an earlier one is scheduled.
+    """
+
+    def __init__(self):
+        self.heap = []  # [deadline, sequence, channel_id, guild_id]; channel_id is None when stale
+        self.entries = {}  # channel_id -> live heap entry
+        self.sequence = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.callback = None
+        self.task = None
+        self.running = set()  # Fired callback tasks, kept referenced until they finish
+
+    def __contains__(self, channel_id):
+        return channel_id in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def deadline(self, channel_id):
+        """Returns the pending deadline for channel_id as a UNIX timestamp, or None."""
+        entry = self.entries.get(channel_id)
+        return entry[0] if entry else None
+
+    def schedule(self, channel_id, guild_id, deadline):
+        """Sets (or moves) the deadline for channel_id."""
+        self.cancel(channel_id)
+        entry = [deadline, next(self.sequence), channel_id, guild_id]
+        self.entries[channel_id] = entry
+        heapq.heappush(self.heap, entry)
+        if self.heap[0] is entry:
+            self.wakeup.set()
+        if len(self.heap) > 64 and len(self.heap) > 2 * len(self.entries):
+            self.heap = [e for e in self.heap if e[2] is not None]
+            heapq.heapify(self.heap)
+
+    def cancel(self, channel_id):
+        """Drops the deadline for channel_id. Returns True if one was pending."""
+        entry = self.entries.pop(channel_id, None)
+        if entry is None:
+            return False
+        entry[2] = None
+        return True
+
+    def start(self, callback):
+        """Starts the runner task once; callback(channel_id, guild_id) is awaited for each due deadline."""
+        self.callback = callback
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while True:
+            while self.heap and self.heap[0][2] is None:
+                heapq.heappop(self.heap)
+            timeout = self.heap[0][0] - time.time() if self.heap else None
+            if timeout is None or timeout > 0:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, channel_id, guild_id = heapq.heappop(self.heap)
+            del self.entries[channel_id]
+            task = asyncio.create_task(self.callback(channel_id, guild_id))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+ticket_timers = DeadlineScheduler()  # Auto-close deadlines for open tickets
+
+# --- Log Channel Writer ---
+class LogSink:
+    """
+    Buffers log-channel posts and sends them in batches.
+
+    post() never blocks: embeds are queued and flushed up to 10 per message
+    (and within Discord's 6000-character embed budget) whenever a batch
+    fills or every flush_interval seconds. Posts carrying content or a file
+    are sent on their own, in order. With a webhook URL, everything goes
+    through the webhook and its own rate-limit bucket.
+    """
+
+    MAX_EMBEDS = 10
+    MAX_EMBED_CHARS = 6000
+    MAX_PENDING_FILES = 2  # post_file() waits above this so exporters stay memory-bounded
+
+    def __init__(self, channel_id, webhook_url=None, flush_interval=LOG_FLUSH_INTERVAL):
+        self.channel_id = channel_id
+        self.webhook_url = webhook_url
+        self.flush_interval = flush_interval
+        self.webhook = None
+        self.pending = collections.deque()  # (content, embed, file)
+        self.pending_files = 0
+        self.wakeup = asyncio.Event()
+        self.file_sent = asyncio.Event()
+        self.task = None
+        self.closing = False
+
+    def post(self, embed=None, content=None, file=None):
+        """Queues a log post. Never awaits, so user-facing flows are not held up by the log channel."""
+        if self.task is None:
+            self.start()
+        self.pending.append((content, embed, file))
+        if file is not None:
+            self.pending_files += 1
+            self.wakeup.set()
+        elif len(self.pending) >= self.MAX_EMBEDS:
+            self.wakeup.set()
+
+    async def post_file(self, file, embed=None, content=None):
+        """Queues a post with a file, waiting while too many uploads are already queued."""
+        self.post(embed=embed, content=content, file=file)
+        while self.pending_files > self.MAX_PENDING_FILES:
+            self.file_sent.clear()
+            await self.file_sent.wait()
+
+    def start(self):
+        if self.webhook_url and self.webhook is None:
+            self.webhook = discord.Webhook.from_url(self.webhook_url, client=bot)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+            if self.closing:
+                return
+
+    async def close(self):
+        """Stops the flush loop once everything already queued has been sent."""
+        self.closing = True
+        self.wakeup.set()
+        if self.task is not None:
+            await self.task
+
+    async def flush(self):
+        """Sends everything queued so far."""
+        while self.pending:
+            content, embed, file = self.pending.popleft()
+            if content is None and file is None:
+                embeds = [embed]
+                embed_chars = len(embed)
+                while self.pending and len(embeds) < self.MAX_EMBEDS:
+                    next_content, next_embed, next_file = self.pending[0]
+                    if next_content is not None or next_file is not None or embed_chars + len(next_embed) > self.MAX_EMBED_CHARS:
+                        break
+                    self.pending.popleft()
+                    embeds.append(next_embed)
+                    embed_chars += len(next_embed)
+                await self._send(embeds=embeds)
+            else:
+                await self._send(content=content, embeds=[embed] if embed else None, file=file)
+                if file is not None:
+                    self.pending_files -= 1
+                    self.file_sent.set()
+
+    async def _send(self, content=None, embeds=None, file=None):
+        kwargs = {}
+        if content is not None:
+            kwargs["content"] = content
+        if embeds:
+            kwargs["embeds"] = embeds
+        if file is not None:
+            kwargs["file"] = file
+        try:
+            if self.webhook:
+                await self.webhook.send(**kwargs)
+            else:
+                channel = bot.get_channel(self.channel_id)
+                if channel is None:
+                    log.warning("Log channel %s not found. Dropping log message.", self.channel_id)
+                    return
+                await channel.send(**kwargs)
+        except Exception:
+            log.exception("Error sending to log channel %s", self.channel_id)
+
+LOG_SINKS = {}  # (channel_id, webhook_url) -> LogSink, shared by guilds logging to the same place
+
+def get_log_sink(channel_id, webhook_url=None):
+    key = (channel_id, webhook_url)
+    if key not in LOG_SINKS:
+        LOG_SINKS[key] = LogSink(channel_id, webhook_url=webhook_url)
+    return LOG_SINKS[key]
+
+# --- Guild Configuration ---
+class GuildConfig:
+    """
+    Ticket settings for one guild.
+
+    GUILD_CONFIG_FILE holds {"default": {...}, "guilds": {"<guild_id>": {...}}}.
+    Guild entries are layered over "default", which is layered over the
+    module-level constants. Button styles are given by name ("primary",
+    "success", ...). Permission data is precompiled into a frozenset.
+    """
+
+    def __init__(self, guild_id=None, data=None):
+        data = data or {}
+        self.guild_id = guild_id
+        self.staff_role_id = int(data.get("staff_role_id", STAFF_ROLE_ID))
+        self.owner_role_id = int(data.get("owner_role_id", OWNER_ROLE_ID))
+        self.log_channel_id = int(data.get("log_channel_id", LOG_CHANNEL_ID))
+        self.log_webhook_url = data.get("log_webhook_url", LOG_WEBHOOK_URL)
+        self.auto_close_time = int(data.get("auto_close_time", AUTO_CLOSE_TIME))
+        self.categories = self.parse_buttons(data["categories"]) if "categories" in data else CATEGORIES_DATA
+        self.payment_methods = self.parse_buttons(data["payment_methods"]) if "payment_methods" in data else PAYMENT_METHODS
+        self.privileged_role_ids = frozenset((self.staff_role_id, self.owner_role_id))
+        self.log_sink = get_log_sink(self.log_channel_id, self.log_webhook_url)
+        self.panel_embed = discord.Embed(
+            title="Support Ticket System",
+            description=(
+                "Click on a category button below to open a new support ticket.\n"
+                f"Tickets will automatically close after {self.auto_close_time // 60} minutes of inactivity."
+            ),
+            color=discord.Color.purple()
+        )
+        self.panel_view = None  # Built by register_persistent_views()
+        self.payment_methods_view = None  # Registered for persistent dispatch only; never sent
+
+    @staticmethod
+    def parse_buttons(buttons):
+        return {
+            key: {**data, "style": discord.ButtonStyle[data["style"]] if isinstance(data.get("style"), str) else data.get("style", discord.ButtonStyle.secondary)}
+            for key, data in buttons.items()
+        }
+
+DEFAULT_GUILD_CONFIG = GuildConfig()
+GUILD_CONFIGS = {}  # guild_id -> GuildConfig; guilds without an entry use DEFAULT_GUILD_CONFIG
+guild_config_mtime = None
+guild_config_watcher = None  # Task running watch_guild_config()
+STAFF_CACHE = {}  # (guild_id, member_id) -> staff-or-owner result, invalidated by on_member_update
+STAFF_CACHE_MAX_SIZE = 50000
+
+def get_guild_config(guild_id):
+    return GUILD_CONFIGS.get(guild_id, DEFAULT_GUILD_CONFIG)
+
+def read_guild_config_file(known_mtime, force):
+    """Blocking part of load_guild_configs(). Returns (mtime, data), with data None if unchanged."""
+    try:
+        mtime = os.path.getmtime(GUILD_CONFIG_FILE)
+    except FileNotFoundError:
+        mtime = None
+    if mtime == known_mtime and not force:
+        return mtime, None
+    if mtime is None:
+        return None, {}
+    with open(GUILD_CONFIG_FILE, 'r') as f:
+        return mtime, json.load(f)
+
+async def load_guild_configs(force=False):
+    """(Re)loads GUILD_CONFIG_FILE if it changed since the last load. Returns True if configs were replaced."""
+    global DEFAULT_GUILD_CONFIG, GUILD_CONFIGS, guild_config_mtime
+    try:
+        mtime, data = await run_io(read_guild_config_file, guild_config_mtime, force)
+    except json.JSONDecodeError as e:
+        log.error("Error decoding %s: %s. Keeping the current configuration.", GUILD_CONFIG_FILE, e)
+        return False
+    if data is None:
+        return False
+
+    defaults = data.get("default", {})
+    DEFAULT_GUILD_CONFIG = GuildConfig(None, defaults)
+    GUILD_CONFIGS = {
+        int(guild_id): GuildConfig(int(guild_id), {**defaults, **overrides})
+        for guild_id, overrides in data.get("guilds", {}).items()
+    }
+    guild_config_mtime = mtime
+    STAFF_CACHE.clear()
+    log.info("Loaded guild configuration for %d guilds from %s.", len(GUILD_CONFIGS), GUILD_CONFIG_FILE)
+    return True
+
+def is_staff_or_owner(member):
+    """
+    True if the member holds one of the guild's privileged roles. Cached per member.
+
+    Only members in the gateway member cache are cached here: on_member_update,
+    which invalidates the result, never fires for the others (the norm in lazy
+    member mode), and their roles come fresh with each message or interaction.
+    """
+    key = (member.guild.id, member.id)
+    result = STAFF_CACHE.get(key)
+    if result is None:
+        privileged_role_ids = get_guild_config(member.guild.id).privileged_role_ids
+        result = any(role.id in privileged_role_ids for role in member.roles)
+        if member.guild.get_member(member.id) is None:
+            return result
+        if len(STAFF_CACHE) >= STAFF_CACHE_MAX_SIZE:
+            STAFF_CACHE.clear()
+        STAFF_CACHE[key] = result
+    return result
+
+async def watch_guild_config():
+    """Hot-reloads GUILD_CONFIG_FILE when it changes on disk."""
+    while True:
+        await asyncio.sleep(GUILD_CONFIG_RELOAD_INTERVAL)
+        try:
+            if await load_guild_configs():
+                register_persistent_views()
+        except Exception:
+            log.exception("Error reloading %s", GUILD_CONFIG_FILE)
+
+# --- Member Resolution ---
+class MemberCache:
+    """
+    Bounded LRU of members fetched on demand, each trusted for ttl seconds.
+
+    Stands in for the member list that startup chunking would otherwise
+    download. Users who are no longer in the guild are cached as None, so
+    transcripts of departed creators do not refetch them every time.
+    """
+
+    def __init__(self, max_size=MEMBER_CACHE_SIZE, ttl=MEMBER_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()  # (guild_id, user_id) -> (expires_at, member or None)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Returns (hit, member) for a live entry."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return False, None
+        if entry[0] <= time.monotonic():
+            del self.entries[key]
+            return False, None
+        self.entries.move_to_end(key)
+        return True, entry[1]
+
+    def put(self, key, member):
+        self.entries[key] = (time.monotonic() + self.ttl, member)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, guild_id, user_id):
+        self.entries.pop((guild_id, user_id), None)
+
+    async def resolve(self, guild, user_id):
+        """
+        Returns the guild's member with user_id, or None if they are not in it.
+
+        The gateway cache is checked first, then this cache, then the API.
+        Fetch errors other than NotFound are logged and return None uncached.
+        """
+        member = guild.get_member(user_id)
+        if member is not None:
+            return member
+        key = (guild.id, user_id)
+        hit, member = self.get(key)
+        if hit:
+            return member
+        try:
+            member = await guild.fetch_member(user_id)
+        except discord.NotFound:
+            member = None
+        except discord.HTTPException:
+            log.warning("Failed to fetch member", exc_info=True, extra={"guild_id": guild.id, "user_id": user_id})
+            return None
+        self.put(key, member)
+        return member
+
+member_cache = MemberCache()
+
+# --- Component Router ---
+COMPONENT_ROUTES = {}  # custom_id -> async handler(interaction)
+
+def component_route(*custom_ids):
+    """Registers a handler for one or more button custom_ids."""
+    def decorator(handler):
+        for custom_id in custom_ids:
+            COMPONENT_ROUTES[custom_id] = handler
+        return handler
+    return decorator
+
+async def dispatch_component(interaction: discord.Interaction):
+    """Button callback shared by every persistent view: one dict lookup per click."""
+    handler = COMPONENT_ROUTES.get(interaction.data['custom_id'])
+    if handler:
+        await handler(interaction)
+
+def routed_button(**kwargs):
+    button = discord.ui.Button(**kwargs)
+    button.callback = dispatch_component
+    return button
 
 # --- Payment Methods View ---
 class PaymentMethodsView(discord.ui.View):
     """A view for displaying payment method buttons."""
     
-    def __init__(self):
+    def __init__(self, payment_methods):
         super().__init__(timeout=None)
         
         # Add payment method buttons
-        for method_id, method_data in PAYMENT_METHODS.items():
-            button = discord.ui.Button(
+        for method_id, method_data in payment_methods.items():
+            self.add_item(routed_button(
                 label=method_data["label"],
                 emoji=method_data["emoji"],
                 style=method_data["style"],
                 custom_id=f"payment_{method_id}"
-            )
-            
-            # Create a proper callback function with closure
-            def make_callback(method_link):
-                async def payment_callback(interaction):
-                    await interaction.response.send_message(method_link, ephemeral=True)
-                return payment_callback
-            
-            button.callback = make_callback(method_data["link"])
-            self.add_item(button)
+            ))
 
 # --- Ticket Control View ---
 class TicketControlView(discord.ui.View):
@@ -119,173 +1565,361 @@ class TicketControlView(discord.ui.View):
         super().__init__(timeout=None)
         
         # Close ticket button
-        close_button = discord.ui.Button(
+        self.add_item(routed_button(
             label="Close Ticket", 
             style=discord.ButtonStyle.danger, 
             custom_id="close_ticket_button", 
             emoji="🔒"
-        )
-        close_button.callback = self.close_ticket_callback
-        self.add_item(close_button)
+        ))
         
         # Payment methods button
-        payment_button = discord.ui.Button(
+        self.add_item(routed_button(
             label="Payment Methods",
             style=discord.ButtonStyle.secondary,
             custom_id="payment_methods_button",
             emoji="💳"
-        )
-        payment_button.callback = self.payment_methods_callback
-        self.add_item(payment_button)
-    
-    async def close_ticket_callback(self, interaction: discord.Interaction):
-        """Handles the close ticket button click."""
-        # Check if user has any of the required roles, not just top role
-        member = interaction.guild.get_member(interaction.user.id)
-        is_staff_or_owner = any(role.id in [STAFF_ROLE_ID, OWNER_ROLE_ID] for role in member.roles)
-        is_ticket_creator_user = TICKET_CREATOR.get(interaction.channel.id) == interaction.user.id
-
-        if is_ticket_creator_user or is_staff_or_owner:
+        ))
+
+# --- Ticket Panel View ---
+class TicketPanelView(discord.ui.View):
+    """A view with one button per ticket category, posted by !setup."""
+
+    def __init__(self, categories):
+        super().__init__(timeout=None)
+
+        for custom_id, data in categories.items():
+            self.add_item(routed_button(
+                label=data["label"],
+                custom_id=custom_id,
+                emoji=data["emoji_id"],
+                style=data["style"]
+            ))
+
+# Static embeds are built once; the views are built by register_persistent_views() and registered with bot.add_view
+PAYMENT_METHODS_EMBED = discord.Embed(
+    title="💳 Payment Methods",
+    description="Choose your preferred payment method below:",
+    color=discord.Color.blue()
+)
+ticket_control_view = None
+
+def register_persistent_views():
+    """
+    Builds the shared persistent views and registers them so their buttons survive restarts.
+
+    Runs at startup and after every configuration reload. Each guild config
+    gets its own panel and payment views; their custom_ids are routed too.
+    """
+    global ticket_control_view
+    ticket_control_view = TicketControlView()
+    bot.add_view(ticket_control_view)
+    for config in (DEFAULT_GUILD_CONFIG, *GUILD_CONFIGS.values()):
+        config.panel_view = TicketPanelView(config.categories)
+        config.payment_methods_view = PaymentMethodsView(config.payment_methods)
+        bot.add_view(config.panel_view)
+        bot.add_view(config.payment_methods_view)
+        for category_key in config.categories:
+            COMPONENT_ROUTES.setdefault(category_key, open_ticket_callback)
+        for method_id in config.payment_methods:
+            COMPONENT_ROUTES.setdefault(f"payment_{method_id}", payment_method_callback)
+
+# --- Component Handlers ---
+@component_route("close_ticket_button")
+async def close_ticket_callback(interaction: discord.Interaction):
+    """Handles the close ticket button click."""
+    # Check if user has any of the required roles, not just top role
+    is_ticket_creator_user = get_ticket_creator_id(interaction.channel.id) == interaction.user.id
+
+    if is_ticket_creator_user or is_staff_or_owner(interaction.user):
+        # The close pipeline exports the transcript, counts down and deletes in the background
+        if enqueue_close(interaction.channel, interaction.user, "button"):
             await interaction.response.send_message("🔒 Closing ticket... Starting countdown to deletion.", ephemeral=True)
-            
-            # Cancel auto-close timer
-            task = ticket_timers.pop(interaction.channel.id, None)
-            if task:
-                task.cancel()
-            
-            # Create transcript before deletion
-            await create_transcript(interaction.channel, interaction.user)
-            
-            # 10-second countdown
-            countdown_embed = discord.Embed(
-                title="🔒 Ticket Closed",
-                description=f"This ticket has been closed by {interaction.user.mention}.\n\n**⏱️ Deleting in 10 seconds...**",
-                color=discord.Color.red()
-            )
-            countdown_message = await interaction.channel.send(embed=countdown_embed)
-            
-            # Update countdown every second
-            for i in range(9, 0, -1):
-                await asyncio.sleep(1)
-                countdown_embed.description = f"This ticket has been closed by {interaction.user.mention}.\n\n**⏱️ Deleting in {i} seconds...**"
-                try:
-                    await countdown_message.edit(embed=countdown_embed)
-                except:
-                    break  # Message might be deleted or channel gone
-            
-            await asyncio.sleep(1)
-            
-            # Final cleanup and deletion
-            ticket_creator_id_val = TICKET_CREATOR.pop(interaction.channel.id, "Unknown")
-            save_ticket_data()
-            ticket_creator_mention = f"<@{ticket_creator_id_val}>" if ticket_creator_id_val != "Unknown" else "Unknown User"
-            
-            # Log the deletion
-            log_channel = bot.get_channel(LOG_CHANNEL_ID)
-            if log_channel:
-                embed = discord.Embed(
-                    title="✅ Ticket Closed and Deleted",
-                    description=f"Ticket `{interaction.channel.name}` has been closed and deleted.",
-                    color=discord.Color.green()
-                )
-                embed.add_field(name="Created By", value=ticket_creator_mention, inline=True)
-                embed.add_field(name="Closed By", value=interaction.user.mention, inline=True)
-                embed.add_field(name="Closure Method", value="Button + Auto-Delete", inline=True)
-                await log_channel.send(embed=embed)
-            
-            await interaction.channel.delete(reason=f"Ticket closed by {interaction.user.name} - auto-deleted after 10s countdown")
-            print(f"Closed and deleted ticket: {interaction.channel.name} ({interaction.channel.id}) by {interaction.user.name}")
         else:
-            await interaction.response.send_message("You are not authorized to close this ticket.", ephemeral=True)
-    
-    async def payment_methods_callback(self, interaction: discord.Interaction):
-        """Handles the payment methods button click."""
+            await interaction.response.send_message("🔒 This ticket is already being closed.", ephemeral=True)
+    else:
+        await interaction.response.send_message("You are not authorized to close this ticket.", ephemeral=True)
+
+@component_route("payment_methods_button")
+async def payment_methods_callback(interaction: discord.Interaction):
+    """Handles the payment methods button click."""
+    config = get_guild_config(interaction.guild_id)
+    # A fresh view per response: ephemeral sends give the view a timeout and stop it when
+    # that expires, which would break the instance registered for persistent dispatch.
+    view = PaymentMethodsView(config.payment_methods)
+    await interaction.response.send_message(embed=PAYMENT_METHODS_EMBED, view=view, ephemeral=True)
+
+@component_route(*(f"payment_{method_id}" for method_id in PAYMENT_METHODS))
+async def payment_method_callback(interaction: discord.Interaction):
+    """Handles a click on one of the payment method buttons."""
+    method_id = interaction.data['custom_id'].removeprefix("payment_")
+    method_data = get_guild_config(interaction.guild_id).payment_methods.get(method_id)
+    if method_data:
+        await interaction.response.send_message(method_data["link"], ephemeral=True)
+    else:
+        await interaction.response.send_message("This payment method is no longer available.", ephemeral=True)
+
+@component_route(*CATEGORIES_DATA)
+async def open_ticket_callback(interaction: discord.Interaction):
+    """Handles a category button click on the ticket panel."""
+    category_id_key = interaction.data['custom_id']
+    guild = interaction.guild
+    user = interaction.user
+
+    if not guild:
+        await interaction.response.send_message("This action can only be performed in a server.", ephemeral=True)
+        return
+    if category_id_key not in get_guild_config(guild.id).categories:
+        await interaction.response.send_message("This ticket category is no longer available.", ephemeral=True)
+        return
+
+    # Acknowledge within Discord's 3-second window; creation can take longer under load
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    channel, error_message = await create_new_ticket(guild, user, category_id_key)
+
+    if channel:
+        await interaction.followup.send(f"✅ Your ticket has been opened: {channel.mention}", ephemeral=True)
+    else:
+        await interaction.followup.send(f"❌ {error_message}", ephemeral=True)
+
+# --- Ticket Categories ---
+TICKET_CATEGORY_NAME = "Tickets"
+TICKET_CATEGORY_CHANNEL_LIMIT = 50  # Discord's cap on channels per category
+TICKET_CATEGORY_LOCKS = collections.defaultdict(asyncio.Lock)  # guild_id -> lock around category selection
+TICKET_CATEGORY_RESERVATIONS = collections.Counter()  # category_id -> channels currently being created in it
+TICKET_CATEGORY_PENDING = {}  # category_id -> {channel_id: created_at} for created channels not yet in the gateway cache
+TICKET_CATEGORY_FULL_UNTIL = {}  # category_id -> monotonic time until which Discord is known to reject new channels
+TICKET_CATEGORY_PENDING_TTL = 60  # Seconds a created channel may take to reach the cache before it stops being counted
+TICKET_CHANNEL_NAMES = {}  # guild_id -> names of channels in ticket categories, built lazily
+TICKET_NAME_COUNTERS = {}  # (guild_id, base name) -> highest suffix handed out, while any such channel exists
+
+def ticket_category_number(category):
+    """Returns 1 for "Tickets", N for "Tickets N", or None for any other category."""
+    if category is None:
+        return None
+    if category.name == TICKET_CATEGORY_NAME:
+        return 1
+    prefix, _, number = category.name.rpartition(' ')
+    if prefix == TICKET_CATEGORY_NAME and number.isdigit():
+        return int(number)
+    return None
+
+def is_ticket_category(category):
+    """True for the "Tickets" category and its overflow categories "Tickets 2", "Tickets 3", ..."""
+    return ticket_category_number(category) is not None
+
+def is_ticket_channel(channel):
+    """True for channels with a ticket record or living in a ticket category."""
+    return channel.id in TICKETS or is_ticket_category(getattr(channel, 'category', None))
+
+def ticket_category_size(category):
+    """
+    Channels in a ticket category as far as the 50-channel cap is concerned.
+
+    Counts cached channels, slots reserved by creations in progress, and
+    channels already created whose CHANNEL_CREATE event has not reached the
+    cache yet (discord.py only adds them to category.channels then).
+    """
+    pending = TICKET_CATEGORY_PENDING.get(category.id)
+    if pending:
+        now = time.monotonic()
+        for channel_id, created_at in list(pending.items()):
+            if category.guild.get_channel(channel_id) is not None or now - created_at > TICKET_CATEGORY_PENDING_TTL:
+                del pending[channel_id]
+        if not pending:
+            del TICKET_CATEGORY_PENDING[category.id]
+    return len(category.channels) + len(pending or ()) + TICKET_CATEGORY_RESERVATIONS[category.id]
+
+def is_category_full_error(error):
+    """True for Discord's rejection of a channel beyond its category's limit (an invalid form body on parent_id)."""
+    return error.code == 50035 and "parent_id" in error.text
+
+async def acquire_ticket_category(guild):
+    """
+    Returns a ticket category with room for one more channel and reserves that slot.
+
+    Categories are filled in order; when all are full the next overflow
+    category is created. The caller must hand the slot back with
+    release_ticket_category() once the channel exists (passing it, so it keeps
+    counting until the cache has it) or creation failed.
+    """
+    async with TICKET_CATEGORY_LOCKS[guild.id]:
+        categories = sorted(
+            (category for category in guild.categories if is_ticket_category(category)),
+            key=ticket_category_number
+        )
+        now = time.monotonic()
+        for category in categories:
+            if TICKET_CATEGORY_FULL_UNTIL.get(category.id, 0) > now:
+                continue
+            if ticket_category_size(category) < TICKET_CATEGORY_CHANNEL_LIMIT:
+                TICKET_CATEGORY_RESERVATIONS[category.id] += 1
+                return category
+
+        number = ticket_category_number(categories[-1]) + 1 if categories else 1
+        category_name = TICKET_CATEGORY_NAME if number == 1 else f"{TICKET_CATEGORY_NAME} {number}"
+        category = await guild.create_category(category_name, overwrites={
+            guild.default_role: discord.PermissionOverwrite(read_messages=False),
+            guild.me: discord.PermissionOverwrite(read_messages=True, send_messages=True)
+        })
         embed = discord.Embed(
-            title="💳 Payment Methods",
-            description="Choose your preferred payment method below:",
+            title="🆕 New Ticket Category Created",
+            description=f"Created new ticket category: {category.mention}",
             color=discord.Color.blue()
         )
-        
-        payment_view = PaymentMethodsView()
-        await interaction.response.send_message(embed=embed, view=payment_view, ephemeral=True)
+        get_guild_config(guild.id).log_sink.post(embed=embed)
+        TICKET_CATEGORY_RESERVATIONS[category.id] += 1
+        return category
+
+def release_ticket_category(category, channel=None):
+    if channel is not None:
+        TICKET_CATEGORY_PENDING.setdefault(category.id, {})[channel.id] = time.monotonic()
+    TICKET_CATEGORY_RESERVATIONS[category.id] -= 1
+    if TICKET_CATEGORY_RESERVATIONS[category.id] <= 0:
+        del TICKET_CATEGORY_RESERVATIONS[category.id]
+
+def ticket_channel_names(guild):
+    """Returns the set of channel names used in the guild's ticket categories."""
+    names = TICKET_CHANNEL_NAMES.get(guild.id)
+    if names is None:
+        names = {
+            channel.name
+            for category in guild.categories if is_ticket_category(category)
+            for channel in category.channels
+        }
+        TICKET_CHANNEL_NAMES[guild.id] = names
+    return names
+
+def claim_ticket_channel_name(guild, base):
+    """Picks an unused ticket channel name derived from base and reserves it in the name index."""
+    names = ticket_channel_names(guild)
+    counter = TICKET_NAME_COUNTERS.get((guild.id, base), 0)
+    name = f"{base}-{counter}" if counter else base
+    while name in names:
+        counter += 1
+        name = f"{base}-{counter}"
+    TICKET_NAME_COUNTERS[(guild.id, base)] = counter
+    names.add(name)
+    return name
+
+def release_ticket_channel_name(guild_id, name):
+    """
+    Drops a ticket channel name from the name index.
+
+    Once no channel is left with the name's base, its counter is pruned too,
+    so TICKET_NAME_COUNTERS only holds bases that are in use.
+    """
+    names = TICKET_CHANNEL_NAMES.get(guild_id)
+    if names is None:
+        return
+    names.discard(name)
+    base, _, suffix = name.rpartition("-")
+    for candidate in (name, base if suffix.isdigit() else None):
+        if candidate and (guild_id, candidate) in TICKET_NAME_COUNTERS:
+            prefix = candidate + "-"
+            if not any(other == candidate or (other.startswith(prefix) and other[len(prefix):].isdigit()) for other in names):
+                del TICKET_NAME_COUNTERS[(guild_id, candidate)]
 
 # --- Core Ticket Management Function ---
+TICKET_CREATIONS_IN_FLIGHT = {}  # (guild_id, user_id, category) -> task creating that ticket
+
 async def create_new_ticket(guild: discord.Guild, user: discord.Member, category_id_key: str):
+    """
+    Creates a new ticket, collapsing concurrent requests for the same
+    (guild, user, category) into a single creation whose result they all share.
+
+    Takes the same arguments and returns the same tuple as create_ticket_channel().
+    """
+    key = (guild.id, user.id, category_id_key)
+    task = TICKET_CREATIONS_IN_FLIGHT.get(key)
+    if task is None:
+        started = time.perf_counter()
+
+        def creation_done(_):
+            TICKET_CREATIONS_IN_FLIGHT.pop(key, None)
+            TICKET_CREATE_SECONDS.observe(time.perf_counter() - started)
+
+        task = asyncio.create_task(create_ticket_channel(guild, user, category_id_key))
+        TICKET_CREATIONS_IN_FLIGHT[key] = task
+        task.add_done_callback(creation_done)
+    # Shielded so a cancelled caller does not abort a creation others are waiting on
+    return await asyncio.shield(task)
+
+async def create_ticket_channel(guild: discord.Guild, user: discord.Member, category_id_key: str):
     """
     Handles the creation of a new ticket channel.
 
     Args:
         guild (discord.Guild): The guild where the ticket is being created.
         user (discord.Member): The user for whom the ticket is being created.
-        category_id_key (str): The key from CATEGORIES_DATA for the ticket category.
+        category_id_key (str): The key from the guild's configured categories.
 
     Returns:
         tuple: A tuple containing (discord.TextChannel, str) if successful,
                otherwise (None, str) with an error message.
     """
-    category_label = CATEGORIES_DATA[category_id_key]["label"]
-    log_channel = bot.get_channel(LOG_CHANNEL_ID)
-
-    # Check for existing tickets by the user within the specific category
-    for channel_id, creator_id in TICKET_CREATOR.items():
-        if creator_id == user.id:
-            existing_channel = guild.get_channel(channel_id)
-            if existing_channel and existing_channel.category and existing_channel.category.name == "Tickets":
-                channel_name_parts = existing_channel.name.split('-')
-                if channel_name_parts and channel_name_parts[0] == category_id_key:
-                    return None, f"You already have an open ticket in the '{category_label}' category: {existing_channel.mention}. Please close that one first."
-
-    # Find or create "Tickets" category
-    ticket_category = discord.utils.get(guild.categories, name="Tickets")
-    if ticket_category is None:
-        try:
-            ticket_category = await guild.create_category("Tickets", overwrites={
-                guild.default_role: discord.PermissionOverwrite(read_messages=False),
-                guild.me: discord.PermissionOverwrite(read_messages=True, send_messages=True)
-            })
-            if log_channel:
-                embed = discord.Embed(
-                    title="🆕 New Ticket Category Created",
-                    description=f"Created new ticket category: {ticket_category.mention}",
-                    color=discord.Color.blue()
-                )
-                await log_channel.send(embed=embed)
-        except discord.Forbidden:
-            return None, "I don't have permission to create categories. Please contact an administrator."
-        except Exception as e:
-            print(f"Error creating ticket category: {e}", file=sys.stderr)
-            traceback.print_exc()
-            return None, f"An error occurred creating the ticket category: {e}"
+    config = get_guild_config(guild.id)
+    category_label = config.categories[category_id_key]["label"]
+
+    # Check for an existing ticket by the user within the specific category
+    existing_channel_id = OPEN_TICKET_INDEX.get((guild.id, user.id, category_id_key))
+    if existing_channel_id is not None:
+        existing_channel = guild.get_channel(existing_channel_id)
+        if existing_channel:
+            return None, f"You already have an open ticket in the '{category_label}' category: {existing_channel.mention}. Please close that one first."
+        # The channel vanished without a delete event reaching us (e.g. while offline)
+        remove_ticket(existing_channel_id)
+
+    # Find a "Tickets" category with room, spilling over into "Tickets 2", "Tickets 3", ...
+    try:
+        ticket_category = await acquire_ticket_category(guild)
+    except discord.Forbidden:
+        return None, "I don't have permission to create categories. Please contact an administrator."
+    except Exception as e:
+        log.exception("Error creating ticket category", extra={"guild_id": guild.id, "user_id": user.id})
+        return None, f"An error occurred creating the ticket category: {e}"
 
-    # Create ticket channel
+    # Create ticket channel with its permissions in a single request
     channel_name_base = f"{category_id_key}-{user.display_name}".replace(" ", "-").lower()
-    channel_name = channel_name_base
-    counter = 0
-    while discord.utils.get(ticket_category.channels, name=channel_name):
-        counter += 1
-        channel_name = f"{channel_name_base}-{counter}"
+    channel_name = claim_ticket_channel_name(guild, channel_name_base)
+    overwrites = {
+        guild.default_role: discord.PermissionOverwrite(read_messages=False, send_messages=False),
+        user: discord.PermissionOverwrite(read_messages=True, send_messages=True, embed_links=True, attach_files=True),
+        guild.get_role(config.owner_role_id): discord.PermissionOverwrite(read_messages=True, send_messages=True),
+        guild.get_role(config.staff_role_id): discord.PermissionOverwrite(read_messages=True, send_messages=True),
+        guild.me: discord.PermissionOverwrite(read_messages=True, send_messages=True, manage_channels=True)
+    }
+    overwrites = {target: overwrite for target, overwrite in overwrites.items() if target is not None}
 
+    channel = None
     try:
-        channel = await ticket_category.create_text_channel(channel_name)
-
-        # Set permissions
-        overwrites = {
-            guild.default_role: discord.PermissionOverwrite(read_messages=False, send_messages=False),
-            user: discord.PermissionOverwrite(read_messages=True, send_messages=True, embed_links=True, attach_files=True),
-            guild.get_role(OWNER_ROLE_ID): discord.PermissionOverwrite(read_messages=True, send_messages=True),
-            guild.get_role(STAFF_ROLE_ID): discord.PermissionOverwrite(read_messages=True, send_messages=True),
-            guild.me: discord.PermissionOverwrite(read_messages=True, send_messages=True, manage_channels=True)
-        }
-        await channel.edit(overwrites=overwrites)
-
-        TICKET_CREATOR[channel.id] = user.id
-        save_ticket_data()
+        while channel is None:
+            try:
+                channel = await ticket_category.create_text_channel(channel_name, overwrites=overwrites)
+            except discord.HTTPException as e:
+                if not is_category_full_error(e):
+                    raise
+                # Full with channels we have not seen yet; skip it for a while and spill over
+                log.warning("Ticket category %s is full; retrying in the next one.", ticket_category.name, extra={"guild_id": guild.id, "user_id": user.id})
+                TICKET_CATEGORY_FULL_UNTIL[ticket_category.id] = time.monotonic() + TICKET_CATEGORY_PENDING_TTL
+                release_ticket_category(ticket_category)
+                ticket_category = None
+                ticket_category = await acquire_ticket_category(guild)
+        release_ticket_category(ticket_category, channel)
+        if channel.name != channel_name:
+            # Discord normalized the name; index what it actually uses
+            ticket_channel_names(guild).discard(channel_name)
+            ticket_channel_names(guild).add(channel.name)
+
+        ticket_record = make_ticket_record(channel.id, user.id, category=category_id_key, guild_id=guild.id)
+        save_ticket(ticket_record)
+        record_ticket_opened(ticket_record)
+        ticket_event_log.append(channel.id, {"op": "open"})
 
         # Ticket initial message (removed payment methods from embed)
         embed = discord.Embed(
             title=f"Welcome to your {category_label} Ticket!",
             description=(
-                f"{user.mention} has opened a ticket. <@&{STAFF_ROLE_ID}>, please assist! 🛠️\n\n"
+                f"{user.mention} has opened a ticket. <@&{config.staff_role_id}>, please assist! 🛠️\n\n"
                 f"📌 **Please describe your issue or request in detail.**\n"
                 f"When communicating, please be clear and provide all necessary information."
             ),
@@ -293,227 +1927,512 @@ async def create_new_ticket(guild: discord.Guild, user: discord.Member, category
         )
         embed.set_footer(text="A staff member will assist you shortly. Thank you for your patience! 💙")
 
-        # Create the ticket control view with close and payment buttons
-        ticket_view = TicketControlView()
-        await channel.send(embed=embed, view=ticket_view)
+        # Attach the shared ticket control view with close and payment buttons
+        await channel.send(embed=embed, view=ticket_control_view)
 
-        if log_channel:
-            embed = discord.Embed(
-                title="📂 Ticket Opened",
-                description=f"A new ticket has been opened: {channel.mention}",
-                color=discord.Color.green()
-            )
-            embed.add_field(name="Ticket Creator", value=user.mention, inline=True)
-            embed.add_field(name="Category", value=category_label, inline=True)
-            embed.add_field(name="Channel Name", value=channel.name, inline=False)
-            await log_channel.send(embed=embed)
+        embed = discord.Embed(
+            title="📂 Ticket Opened",
+            description=f"A new ticket has been opened: {channel.mention}",
+            color=discord.Color.green()
+        )
+        embed.add_field(name="Ticket Creator", value=user.mention, inline=True)
+        embed.add_field(name="Category", value=category_label, inline=True)
+        embed.add_field(name="Channel Name", value=channel.name, inline=False)
+        config.log_sink.post(embed=embed)
 
         # Start auto-close timer
-        task = asyncio.create_task(auto_close_ticket(channel.id, guild.id))
-        ticket_timers[channel.id] = task
+        ticket_timers.schedule(channel.id, guild.id, time.time() + config.auto_close_time)
 
         return channel, None
 
     except discord.Forbidden:
         return None, "I don't have permission to create channels in that category or set permissions. Please contact an administrator."
     except Exception as e:
-        print(f"Error creating ticket channel: {e}", file=sys.stderr)
-        traceback.print_exc()
+        log.exception("Error creating ticket channel", extra={"guild_id": guild.id, "user_id": user.id})
         return None, f"An unexpected error occurred: {e}"
+    finally:
+        if channel is None:
+            if ticket_category is not None:
+                release_ticket_category(ticket_category)
+            ticket_channel_names(guild).discard(channel_name)
 
 # --- Bot Events ---
+@bot.event
+async def setup_hook():
+    """Runs once before connecting to the gateway."""
+    global guild_config_watcher, metrics_runner, transcript_archive_maintainer
+    loop_watchdog.start()
+    await load_guild_configs(force=True)
+    register_persistent_views()
+    # Before the gateway connects, so interactions never see an unopened store or unresumed jobs
+    await load_ticket_data()
+    await load_ticket_stats()
+    await resume_close_jobs()
+    guild_config_watcher = asyncio.create_task(watch_guild_config())
+    if transcript_archive:
+        await transcript_archive.open()
+        transcript_archive_maintainer = asyncio.create_task(maintain_transcript_archive())
+    if METRICS_PORT:
+        metrics_runner = await start_metrics_server()
+
 @bot.event
 async def on_ready():
-    """Event that fires when the bot is ready."""
-    print(f'Bot {bot.user} is ready!')
-    load_ticket_data()  # Load data on startup
-    # Re-launch auto-close timers for existing tickets
-    for channel_id, creator_id in TICKET_CREATOR.items():
-        guild_id = None
-        for guild in bot.guilds:
-            if guild.get_channel(channel_id):
-                guild_id = guild.id
-                break
-        if guild_id:
-            print(f"Restarting timer for ticket channel {channel_id} in guild {guild_id}")
-            task = asyncio.create_task(auto_close_ticket(channel_id, guild_id))
-            ticket_timers[channel_id] = task
-        else:
-            print(f"Could not find guild for channel {channel_id}. Skipping timer restart and cleaning up.")
-            TICKET_CREATOR.pop(channel_id, None)
-            save_ticket_data()
+    """Event that fires when the bot is ready. Startup work runs once per process."""
+    global startup_complete
+    log.info("Bot %s is ready!", bot.user)
+    if startup_complete:
+        # on_ready fires again after a fresh gateway session; events may have been missed
+        for channel_id in TICKETS:
+            ticket_event_log.append(channel_id, {"op": "resume"})
+        log.info("Reconnected to the gateway. Ticket state is already reconciled.")
+        return
+    startup_complete = True
+
+    deadlines = await run_write(ticket_store.get_meta, "auto_close_deadlines", {})
+    if deadlines:
+        store_write("deadlines", ticket_store.set_meta, "auto_close_deadlines", {})  # Consumed; a crash must not replay them
+    ticket_timers.start(auto_close_ticket)
+    await start_close_workers()
+    reconcile_tickets({int(channel_id): deadline for channel_id, deadline in deadlines.items()})
+    await sync_command_tree()
+
+def reconcile_tickets(deadlines=None):
+    """
+    Diffs stored tickets against the channels that actually exist.
+
+    Builds a channel -> guild map once, re-arms auto-close timers for live
+    tickets and drops stale ones, applying all store changes in bulk.
+    deadlines holds the absolute auto-close deadlines saved at the last
+    shutdown; tickets without one fall back to last activity plus the guild's
+    auto-close time. Either way a timer resumes with its remaining time, and
+    one that expired while the bot was down fires right away.
+    """
+    deadlines = deadlines or {}
+    channel_guilds = {channel.id: guild for guild in bot.guilds for channel in guild.channels}
+    stale_channel_ids = []
+    backfilled = []
+    for channel_id, record in TICKETS.items():
+        guild = channel_guilds.get(channel_id)
+        if guild is None:
+            stale_channel_ids.append(channel_id)
+            continue
+        if record["guild_id"] is None:
+            # Records migrated from the legacy JSON file lack guild and category
+            record["guild_id"] = guild.id
+            channel_name_prefix = guild.get_channel(channel_id).name.split('-')[0]
+            record["category"] = channel_name_prefix if channel_name_prefix in get_guild_config(guild.id).categories else None
+            backfilled.append(record)
+        # Messages sent while we were offline are fetched at transcript time
+        ticket_event_log.append(channel_id, {"op": "resume"})
+        if channel_id not in CLOSE_JOBS:
+            deadline = deadlines.get(channel_id, record["last_activity"] + get_guild_config(guild.id).auto_close_time)
+            ticket_timers.schedule(channel_id, guild.id, deadline)
+
+    if backfilled:
+        save_tickets(backfilled)
+    if stale_channel_ids:
+        remove_tickets(stale_channel_ids)
+        for channel_id in stale_channel_ids:
+            ticket_event_log.discard(channel_id)
+    log.info("Reconciled tickets: %d open, %d stale removed, %d backfilled.", len(TICKETS), len(stale_channel_ids), len(backfilled))
+
+@bot.event
+async def on_guild_channel_delete(channel):
+    """Drops ticket state when a ticket channel is deleted, including manual deletions."""
+    if channel.id in TICKETS or is_ticket_category(getattr(channel, 'category', None)):
+        release_ticket_channel_name(channel.guild.id, channel.name)
+    if channel.id in TICKETS:
+        remove_ticket(channel.id)
+        ticket_timers.cancel(channel.id)
+        log.info("Ticket channel %s was deleted. Cleaned up ticket data.", channel.name, extra={"ticket_id": channel.id, "guild_id": channel.guild.id})
+    if attachment_archiver:
+        attachment_archiver.forget(channel.id)
+    ticket_event_log.discard(channel.id)
+
+@bot.event
+async def on_member_update(before, after):
+    """Invalidates the cached staff-or-owner result when a member's roles change."""
+    if before.roles != after.roles:
+        STAFF_CACHE.pop((after.guild.id, after.id), None)
+
+@bot.event
+async def on_raw_member_remove(payload):
+    """Raw so it also fires for members outside the gateway cache (lazy member mode)."""
+    STAFF_CACHE.pop((payload.guild_id, payload.user.id), None)
+    member_cache.invalidate(payload.guild_id, payload.user.id)
+
+@bot.event
+async def on_member_join(member):
+    member_cache.invalidate(member.guild.id, member.id)  # Drops a cached "not in guild"
+
+@bot.event
+async def on_guild_channel_update(before, after):
+    """Keeps the ticket channel name index in sync with renames and moves."""
+    names = TICKET_CHANNEL_NAMES.get(after.guild.id)
+    if names is None:
+        return
+    if is_ticket_category(getattr(before, 'category', None)):
+        release_ticket_channel_name(after.guild.id, before.name)
+    if is_ticket_category(getattr(after, 'category', None)):
+        names.add(after.name)
+
+@bot.event
+async def on_message(message):
+    """
+    Front filter for gateway messages.
+
+    Only ticket channel traffic and messages starting with the command prefix
+    get past the first check; everything else in the guild is dropped before
+    the command parser sees it. TICKETS is keyed by channel ID, so it doubles
+    as the set of ticket channels.
+    """
+    record = TICKETS.get(message.channel.id)
+    if record is None:
+        if message.content.startswith(COMMAND_PREFIX):
+            await bot.process_commands(message)
+        return
+    track_ticket_activity(message, record)
+    capture_ticket_message(message)
+    if message.content.startswith(COMMAND_PREFIX):
+        await bot.process_commands(message)
+
+def track_ticket_activity(message, record):
+    """Records user activity in a ticket channel and pushes its auto-close deadline forward."""
+    if message.author == bot.user or message.channel.id in CLOSE_JOBS:
+        return
+    record["last_activity"] = time.time()
+    save_ticket(record)
+    ticket_timers.schedule(message.channel.id, message.guild.id, record["last_activity"] + get_guild_config(message.guild.id).auto_close_time)
+
+def capture_ticket_message(message):
+    """Appends a message sent in a ticket channel to its event log."""
+    ticket_event_log.append(message.channel.id, {"op": "message", "entry": transcript_entry(message)})
+    if attachment_archiver and message.attachments and message.channel.id not in CLOSE_JOBS:
+        attachment_archiver.submit(message.channel.id, message.attachments)
+
+@bot.event
+async def on_raw_message_edit(payload):
+    """Records message edits in ticket channels. Raw events work without the message cache."""
+    if payload.channel_id in TICKETS:
+        ticket_event_log.append(payload.channel_id, {"op": "edit", "entry": transcript_entry(payload.message)})
+
+@bot.event
+async def on_raw_message_delete(payload):
+    """Records message deletions in ticket channels."""
+    if payload.channel_id in TICKETS:
+        ticket_event_log.append(payload.channel_id, {"op": "delete", "ids": [payload.message_id]})
+
+@bot.event
+async def on_raw_bulk_message_delete(payload):
+    """Records bulk message deletions in ticket channels."""
+    if payload.channel_id in TICKETS:
+        ticket_event_log.append(payload.channel_id, {"op": "delete", "ids": list(payload.message_ids)})
 
 @bot.event
 async def on_command_error(ctx, error):
-    """Global command error handler."""
+    """Global command error handler. Also handles slash invocations of hybrid commands (replies are ephemeral there)."""
+    if isinstance(error, commands.HybridCommandError):
+        error = error.original
     if isinstance(error, commands.CommandNotFound):
         await ctx.send("❌ That command does not exist. Please check your spelling.")
     elif isinstance(error, commands.MissingRequiredArgument):
-        await ctx.send(f"❌ Missing a required argument: `{error.param.name}`.")
+        await ctx.send(f"❌ Missing a required argument: `{error.param.name}`.", ephemeral=True)
     elif isinstance(error, commands.MissingPermissions):
-        await ctx.send("❌ You don't have the necessary permissions to use this command.")
+        await ctx.send("❌ You don't have the necessary permissions to use this command.", ephemeral=True)
     elif isinstance(error, commands.BadArgument):
-        await ctx.send(f"❌ Invalid argument provided: {error}")
+        await ctx.send(f"❌ Invalid argument provided: {error}", ephemeral=True)
     elif isinstance(error, commands.NoPrivateMessage):
-        await ctx.send("❌ This command cannot be used in private messages.")
+        await ctx.send("❌ This command cannot be used in private messages.", ephemeral=True)
     elif isinstance(error, commands.MemberNotFound):
-        await ctx.send("❌ Member not found. Please provide a valid user or ID.")
+        await ctx.send("❌ Member not found. Please provide a valid user or ID.", ephemeral=True)
     else:
-        print(f"Ignoring exception in command {ctx.command}:", file=sys.stderr)
-        traceback.print_exception(type(error), error, error.__traceback__, file=sys.stderr)
-        await ctx.send("An unexpected error occurred while running this command. Check the console for details.")
+        log.error(
+            "Ignoring exception in command %s", ctx.command,
+            exc_info=(type(error), error, error.__traceback__),
+            extra={"guild_id": ctx.guild.id if ctx.guild else None, "user_id": ctx.author.id}
+        )
+        await ctx.send("An unexpected error occurred while running this command. Check the console for details.", ephemeral=True)
 
 # --- Setup Command ---
 @bot.command()
 @commands.has_permissions(manage_channels=True)
 async def setup(ctx):
     """Sets up the ticket system message with category buttons."""
-    embed = discord.Embed(
-        title="Support Ticket System",
-        description=(
-            "Click on a category button below to open a new support ticket.\n"
-            f"Tickets will automatically close after {AUTO_CLOSE_TIME // 60} minutes of inactivity."
-        ),
-        color=discord.Color.purple()
-    )
-    view = discord.ui.View(timeout=None)
-
-    for custom_id, data in CATEGORIES_DATA.items():
-        button = discord.ui.Button(
-            label=data["label"],
-            custom_id=custom_id,
-            emoji=data["emoji_id"],
-            style=data["style"]
-        )
-        view.add_item(button)
-
+    config = get_guild_config(ctx.guild.id if ctx.guild else None)
     try:
-        await ctx.send(embed=embed, view=view)
+        await ctx.send(embed=config.panel_embed, view=config.panel_view)
         await ctx.message.delete()
     except discord.Forbidden:
         await ctx.author.send("I don't have permission to send messages in that channel or delete commands. Please check my permissions.")
     except Exception as e:
         await ctx.send(f"An error occurred during setup: {e}")
-        print(f"Error during setup command: {e}", file=sys.stderr)
-        traceback.print_exc()
-
-# --- Interaction Handling (Ticket Creation via Button) ---
-@bot.event
-async def on_interaction(interaction):
-    """Handles interactions, specifically button clicks for ticket creation."""
-    if interaction.type == discord.InteractionType.component and interaction.data['custom_id'] in CATEGORIES_DATA:
-        category_id_key = interaction.data['custom_id']
-        guild = interaction.guild
-        user = interaction.user
+        log.exception("Error during setup command", extra={"guild_id": ctx.guild.id if ctx.guild else None, "user_id": ctx.author.id})
 
-        if not guild:
-            await interaction.response.send_message("This action can only be performed in a server.", ephemeral=True)
-            return
-
-        channel, error_message = await create_new_ticket(guild, user, category_id_key)
-
-        if channel:
-            await interaction.response.send_message(f"✅ Your ticket has been opened: {channel.mention}", ephemeral=True)
-        else:
-            await interaction.response.send_message(f"❌ {error_message}", ephemeral=True)
+# --- Reload Configuration Command ---
+@bot.command()
+@commands.has_permissions(manage_guild=True)
+async def reloadconfig(ctx):
+    """Reloads the per-guild configuration file without restarting the bot."""
+    try:
+        await load_guild_configs(force=True)
+        register_persistent_views()
+        await ctx.send(f"✅ Reloaded configuration for {len(GUILD_CONFIGS)} guilds.")
+    except Exception as e:
+        await ctx.send(f"❌ Could not reload the configuration: {e}")
+        log.exception("Error reloading guild configuration", extra={"guild_id": ctx.guild.id if ctx.guild else None, "user_id": ctx.author.id})
 
 # --- New Ticket Command ---
-@bot.command()
+@bot.hybrid_command()
 @commands.has_permissions(manage_channels=True)
+@app_commands.default_permissions(manage_channels=True)
+@app_commands.guild_only()
+@app_commands.describe(member="Member to open the ticket for", category_key="Ticket category")
 async def openticket(ctx, member: discord.Member, category_key: str):
     """
     Opens a new ticket for a specified member in a given category.
     Usage: !openticket <@member> <category_key>
     Example: !openticket @User claims
     """
-    if category_key not in CATEGORIES_DATA:
-        available_categories = ", ".join(CATEGORIES_DATA.keys())
-        await ctx.send(f"❌ Invalid category key. Available categories: {available_categories}")
-        return
-
     # Check if the command is used in a guild
     if not ctx.guild:
         await ctx.send("This command can only be used in a server.")
         return
 
+    categories = get_guild_config(ctx.guild.id).categories
+    if category_key not in categories:
+        available_categories = ", ".join(categories.keys())
+        await ctx.send(f"❌ Invalid category key. Available categories: {available_categories}", ephemeral=True)
+        return
+
+    await ctx.defer(ephemeral=True)
     channel, error_message = await create_new_ticket(ctx.guild, member, category_key)
 
     if channel:
-        await ctx.send(f"✅ Ticket opened for {member.mention}: {channel.mention}")
+        await ctx.send(f"✅ Ticket opened for {member.mention}: {channel.mention}", ephemeral=True)
     else:
-        await ctx.send(f"❌ Could not open ticket for {member.mention}: {error_message}")
+        await ctx.send(f"❌ Could not open ticket for {member.mention}: {error_message}", ephemeral=True)
+
+@openticket.autocomplete("category_key")
+async def openticket_category_autocomplete(interaction: discord.Interaction, current: str):
+    """Offers the guild's configured ticket categories."""
+    categories = get_guild_config(interaction.guild_id).categories
+    current = current.lower()
+    return [
+        app_commands.Choice(name=data["label"][:100], value=key)
+        for key, data in categories.items()
+        if current in key.lower() or current in data["label"].lower()
+    ][:25]
 
 # --- Auto-Close Function ---
 async def auto_close_ticket(channel_id, guild_id):
-    """Automatically closes a ticket after a period of inactivity."""
-    log_channel = bot.get_channel(LOG_CHANNEL_ID)
+    """Queues an auto-close for a ticket once its auto-close deadline fires."""
     try:
-        await asyncio.sleep(AUTO_CLOSE_TIME)
         guild = bot.get_guild(guild_id)
         if not guild:
-            print(f"Guild {guild_id} not found for auto-close task. Ticket {channel_id} might be from a removed guild. Cleaning up data.")
-            TICKET_CREATOR.pop(channel_id, None)
-            save_ticket_data()
+            log.info("Guild not found for auto-close task. The ticket might be from a removed guild. Cleaning up data.", extra={"ticket_id": channel_id, "guild_id": guild_id})
+            remove_ticket(channel_id)
             return
 
         channel = guild.get_channel(channel_id)
         if channel:
-            messages = []
-            async for msg in channel.history(limit=5, oldest_first=False):
-                messages.append(msg)
+            record = TICKETS.get(channel.id)
+            if record is None or channel.id in CLOSE_JOBS:
+                return  # Closed, or being closed, while the deadline was pending
+
+            # last_activity is pushed by track_ticket_activity, so no history fetch is needed
+            idle_deadline = record["last_activity"] + get_guild_config(guild.id).auto_close_time
+            if time.time() >= idle_deadline:
+                enqueue_close(channel, bot.user, "auto")
+                log.info("Queued auto-close for ticket %s", channel.name, extra={"ticket_id": channel.id, "guild_id": guild.id})
+            else:
+                log.debug("Ticket %s has activity, resetting auto-close timer.", channel.name, extra={"ticket_id": channel.id, "guild_id": guild.id})
+                ticket_timers.schedule(channel.id, guild.id, idle_deadline)
+        else:
+            log.info("Ticket channel not found for auto-close (might have been deleted manually or bot restarted). Cleaning up data.", extra={"ticket_id": channel_id, "guild_id": guild_id})
+            remove_ticket(channel_id)
+    except Exception:
+        log.exception("Error during auto-close of ticket", extra={"ticket_id": channel_id, "guild_id": guild_id})
+
+# --- Close Pipeline ---
+CLOSE_JOBS = {}  # channel_id -> close job that is queued, counting down or running
+close_queue = asyncio.Queue()
+close_workers = []
+close_workers_stopping = False  # Set on shutdown; workers stop after their current job
+
+CLOSE_METHOD_LABELS = {
+    "button": "Button + Auto-Delete",
+    "command": "Command + Auto-Delete",
+    "auto": "Auto-Close (Inactivity)",
+    "bulk": "Bulk Close"
+}
 
-            user_messages = [msg for msg in messages if msg.author != bot.user]
+def enqueue_close(channel, closer, method):
+    """
+    Persists a close job for a ticket channel and hands it to the close workers.
+
+    Returns False if the ticket is already being closed. The job survives
+    restarts: resume_close_jobs() requeues every unfinished job on startup.
+    It is persisted before it is registered, so a failed write leaves the
+    ticket closable.
+    """
+    if channel.id in CLOSE_JOBS:
+        return False
+    job = make_close_job(channel, closer, method)
+    store_write("upsert_close_job", ticket_store.upsert_close_job, dict(job))
+    CLOSE_JOBS[channel.id] = job
+    ticket_timers.cancel(channel.id)
+    close_queue.put_nowait(job)
+    return True
+
+def finish_close_job(job):
+    CLOSE_JOBS.pop(job["channel_id"], None)
+    store_write("delete_close_job", ticket_store.delete_close_job, job["channel_id"])
+
+async def run_close_job(job):
+    """
+    Advances a close job through its stages: transcript, countdown, delete.
 
-            if not user_messages:
-                ticket_creator_id_val = TICKET_CREATOR.pop(channel.id, "Unknown")
-                save_ticket_data()
-                ticket_creator_mention = f"<@{ticket_creator_id_val}>" if ticket_creator_id_val != "Unknown" else "Unknown User"
+    The countdown is a single message with a relative timestamp. While it runs
+    the job is parked on a loop timer instead of holding a worker.
+    """
+    guild = bot.get_guild(job["guild_id"])
+    channel = guild.get_channel(job["channel_id"]) if guild else None
+    if channel is None:
+        log.info("Ticket channel is already gone. Dropping its close job.", extra={"ticket_id": job["channel_id"], "guild_id": job["guild_id"]})
+        remove_ticket(job["channel_id"])
+        finish_close_job(job)
+        return
 
-                close_reason = f"No activity for {AUTO_CLOSE_TIME // 60} minutes (auto-closed)."
+    auto_closed = job["method"] == "auto"
+    config = get_guild_config(guild.id)
+    idle_minutes = config.auto_close_time // 60
+    closer = guild.get_member(job["closer_id"]) or bot.get_user(job["closer_id"]) or await bot.fetch_user(job["closer_id"])
 
-                await create_transcript(channel, bot.user, auto_closed=True)
+    if job["stage"] == "transcript":
+        await create_transcript(channel, closer, auto_closed=auto_closed)
+        job["stage"] = "countdown"
+        store_write("upsert_close_job", ticket_store.upsert_close_job, dict(job))
 
-                close_message = (
-                    f"This ticket has been automatically closed due to inactivity ({AUTO_CLOSE_TIME // 60} minutes).\n"
-                    f"Reason: {close_reason}\n"
-                    f"Ticket created by: {ticket_creator_mention}"
-                )
-                await channel.send(close_message)
-                await asyncio.sleep(5)
-                await channel.delete(reason=close_reason)
-
-                if log_channel:
-                    embed = discord.Embed(
-                        title="❌ Ticket Auto-Closed",
-                        description=f"Ticket `{channel.name}` has been auto-closed due to inactivity.",
-                        color=discord.Color.red()
-                    )
-                    embed.add_field(name="Created By", value=ticket_creator_mention, inline=True)
-                    embed.add_field(name="Reason", value=close_reason, inline=False)
-                    embed.add_field(name="Ticket Creator User ID", value=ticket_creator_id_val, inline=False)
-                    await log_channel.send(embed=embed)
-                print(f"Auto-closed ticket: {channel.name} ({channel.id})")
-            else:
-                print(f"Ticket {channel.name} has activity, resetting auto-close timer.")
-                task = asyncio.create_task(auto_close_ticket(channel.id, guild.id))
-                ticket_timers[channel.id] = task
+    if job["stage"] == "countdown":
+        job["delete_at"] = time.time() + (AUTO_CLOSE_DELETE_DELAY if auto_closed else CLOSE_COUNTDOWN)
+        job["stage"] = "delete"
+        store_write("upsert_close_job", ticket_store.upsert_close_job, dict(job))
+        if auto_closed:
+            ticket_creator_id_val = get_ticket_creator_id(channel.id)
+            ticket_creator_mention = f"<@{ticket_creator_id_val}>" if ticket_creator_id_val else "Unknown User"
+            await channel.send(
+                f"This ticket has been automatically closed due to inactivity ({idle_minutes} minutes).\n"
+                f"Reason: No activity for {idle_minutes} minutes (auto-closed).\n"
+                f"Ticket created by: {ticket_creator_mention}"
+            )
         else:
-            print(f"Ticket channel {channel_id} not found for auto-close (might have been deleted manually or bot restarted). Cleaning up data.")
-            TICKET_CREATOR.pop(channel_id, None)
-            save_ticket_data()
-    except asyncio.CancelledError:
-        print(f"Auto-close task for channel {channel_id} was cancelled.")
-        TICKET_CREATOR.pop(channel_id, None)
-        save_ticket_data()
-    except discord.NotFound:
-        print(f"Channel or message for {channel_id} not found during auto-close (already deleted?). Cleaning up data.")
-        TICKET_CREATOR.pop(channel_id, None)
-        save_ticket_data()
-    except Exception as e:
-        print(f"Error during auto-close of ticket {channel_id}: {e}", file=sys.stderr)
-        traceback.print_exc()
-    finally:
-        ticket_timers.pop(channel_id, None)
+            countdown_embed = discord.Embed(
+                title="🔒 Ticket Closed",
+                description=f"This ticket has been closed by {closer.mention}.\n\n**⏱️ Deleting <t:{int(job['delete_at'])}:R>...**",
+                color=discord.Color.red()
+            )
+            await channel.send(embed=countdown_embed)
+
+    remaining = job["delete_at"] - time.time()
+    if remaining > 0:
+        asyncio.get_running_loop().call_later(remaining, close_queue.put_nowait, job)
+        return
+
+    ticket_record = remove_ticket(channel.id)
+    record_ticket_closed(guild.id, ticket_record, job)
+    ticket_creator_id_val = ticket_record["creator_id"] if ticket_record else "Unknown"
+    ticket_creator_mention = f"<@{ticket_creator_id_val}>" if ticket_creator_id_val != "Unknown" else "Unknown User"
+
+    if auto_closed:
+        close_reason = f"No activity for {idle_minutes} minutes (auto-closed)."
+        embed = discord.Embed(
+            title="❌ Ticket Auto-Closed",
+            description=f"Ticket `{channel.name}` has been auto-closed due to inactivity.",
+            color=discord.Color.red()
+        )
+        embed.add_field(name="Created By", value=ticket_creator_mention, inline=True)
+        embed.add_field(name="Reason", value=close_reason, inline=False)
+        embed.add_field(name="Ticket Creator User ID", value=ticket_creator_id_val, inline=False)
+        config.log_sink.post(embed=embed)
+    else:
+        close_reason = f"Ticket closed by {closer.name} - auto-deleted after {CLOSE_COUNTDOWN}s countdown"
+        embed = discord.Embed(
+            title="✅ Ticket Closed and Deleted",
+            description=f"Ticket `{channel.name}` has been closed and deleted.",
+            color=discord.Color.green()
+        )
+        embed.add_field(name="Created By", value=ticket_creator_mention, inline=True)
+        embed.add_field(name="Closed By", value=closer.mention, inline=True)
+        embed.add_field(name="Closure Method", value=CLOSE_METHOD_LABELS[job["method"]], inline=True)
+        if job["method"] != "bulk":  # Bulk closes are logged by their summary
+            config.log_sink.post(embed=embed)
+
+    await channel.delete(reason=close_reason)
+    finish_close_job(job)
+    if job.get("requested_at"):
+        CLOSE_PIPELINE_SECONDS.observe(time.time() - job["requested_at"], method=job["method"])
+    log.info("Closed and deleted ticket %s by %s", channel.name, closer.name, extra={"ticket_id": channel.id, "guild_id": guild.id, "user_id": closer.id})
+
+async def close_worker():
+    """Pulls close jobs off close_queue and runs them one stage at a time."""
+    while True:
+        job = await close_queue.get()
+        if close_workers_stopping:
+            # Left for the next startup; the job is still in the store
+            close_queue.task_done()
+            return
+        try:
+            await run_close_job(job)
+        except discord.NotFound:
+            log.info("Ticket channel disappeared while closing. Cleaning up data.", extra={"ticket_id": job["channel_id"], "guild_id": job["guild_id"]})
+            remove_ticket(job["channel_id"])
+            finish_close_job(job)
+        except Exception:
+            # The job stays in the store and is retried on the next startup
+            log.exception("Error while closing ticket", extra={"ticket_id": job["channel_id"], "guild_id": job["guild_id"], "user_id": job["closer_id"]})
+            CLOSE_JOBS.pop(job["channel_id"], None)
+        finally:
+            close_queue.task_done()
+
+async def resume_close_jobs():
+    """
+    Requeues unfinished close jobs from the store.
+
+    Runs in setup_hook; the jobs wait in close_queue until the workers start
+    once guilds are available. Channels that already have a job in
+    CLOSE_JOBS are skipped so nothing is closed twice.
+    """
+    for job in await run_write(ticket_store.load_close_jobs):
+        if job["channel_id"] in CLOSE_JOBS:
+            continue
+        log.info("Resuming close job at stage '%s'", job["stage"], extra={"ticket_id": job["channel_id"], "guild_id": job["guild_id"]})
+        CLOSE_JOBS[job["channel_id"]] = job
+        close_queue.put_nowait(job)
+
+async def start_close_workers():
+    """Starts the close worker pool once. It works through jobs queued by resume_close_jobs() and enqueue_close()."""
+    if close_workers:
+        return
+    for _ in range(CLOSE_WORKERS):
+        close_workers.append(asyncio.create_task(close_worker()))
+
+async def stop_close_workers(timeout=SHUTDOWN_DRAIN_TIMEOUT):
+    """
+    Lets each close worker finish the job it is running, then stops it.
+
+    Queued jobs and jobs parked in their countdown are not started; they are
+    already in the store and resume on the next startup.
+    """
+    global close_workers_stopping
+    close_workers_stopping = True
+    for _ in close_workers:
+        close_queue.put_nowait(None)  # Wakes idle workers so they can exit
+    if not close_workers:
+        return
+    done, pending = await asyncio.wait(close_workers, timeout=timeout)
+    for task in pending:
+        log.warning("Close job still running after %ss; it will be retried on the next startup.", timeout)
+        task.cancel()
 
 # --- Close Command View ---
 class ConfirmView(discord.ui.View):
@@ -548,305 +2467,1029 @@ class ConfirmView(discord.ui.View):
             await self.message.edit(content="Ticket close confirmation timed out.", view=self)
 
 # --- Close Command ---
-@bot.command()
+@bot.hybrid_command()
 @commands.has_permissions(manage_channels=True)
+@app_commands.default_permissions(manage_channels=True)
+@app_commands.guild_only()
 async def close(ctx):
     """Closes the current ticket channel."""
-    log_channel = bot.get_channel(LOG_CHANNEL_ID)
-    if ctx.channel.category and ctx.channel.category.name == "Tickets":
-        staff_role = ctx.guild.get_role(STAFF_ROLE_ID)
-        owner_role = ctx.guild.get_role(OWNER_ROLE_ID)
-        is_staff_or_owner = staff_role in ctx.author.roles or owner_role in ctx.author.roles
-        is_ticket_creator = TICKET_CREATOR.get(ctx.channel.id) == ctx.author.id
-
-        if not (is_staff_or_owner or is_ticket_creator):
-            await ctx.send("❌ You do not have permission to close this ticket.")
+    if is_ticket_channel(ctx.channel):
+        is_ticket_creator = get_ticket_creator_id(ctx.channel.id) == ctx.author.id
+
+        if not (is_staff_or_owner(ctx.author) or is_ticket_creator):
+            await ctx.send("❌ You do not have permission to close this ticket.", ephemeral=True)
             return
 
-        original_message_sent = await ctx.send(f"Are you sure you want to close this ticket?")
+        await ctx.defer(ephemeral=True)
+        original_message_sent = await ctx.send(f"Are you sure you want to close this ticket?", ephemeral=True)
         view = ConfirmView(ctx.author.id)
         await original_message_sent.edit(view=view)
         await view.wait()
 
         if view.value is True:
-            task = ticket_timers.pop(ctx.channel.id, None)
-            if task:
-                task.cancel()
-
-            # Create transcript before deletion
-            await create_transcript(ctx.channel, ctx.author)
-            
-            # 10-second countdown
-            countdown_embed = discord.Embed(
-                title="🔒 Ticket Closed",
-                description=f"This ticket has been closed by {ctx.author.mention}.\n\n**⏱️ Deleting in 10 seconds...**",
-                color=discord.Color.red()
-            )
-            countdown_message = await ctx.channel.send(embed=countdown_embed)
-            
-            # Update countdown every second
-            for i in range(9, 0, -1):
-                await asyncio.sleep(1)
-                countdown_embed.description = f"This ticket has been closed by {ctx.author.mention}.\n\n**⏱️ Deleting in {i} seconds...**"
-                try:
-                    await countdown_message.edit(embed=countdown_embed)
-                except:
-                    break  # Message might be deleted or channel gone
-            
-            await asyncio.sleep(1)
-            
-            # Final cleanup and deletion
-            ticket_creator_id_val = TICKET_CREATOR.pop(ctx.channel.id, "Unknown")
-            save_ticket_data()
-            ticket_creator_mention = f"<@{ticket_creator_id_val}>" if ticket_creator_id_val != "Unknown" else "Unknown User"
-
-            # Delete the channel
-            await ctx.channel.delete(reason=f"Ticket closed by {ctx.author.name} - auto-deleted after 10s countdown")
-
-            if log_channel:
-                embed = discord.Embed(
-                    title="✅ Ticket Closed and Deleted",
-                    description=f"Ticket `{ctx.channel.name}` has been closed and deleted.",
-                    color=discord.Color.green()
-                )
-                embed.add_field(name="Created By", value=ticket_creator_mention, inline=True)
-                embed.add_field(name="Closed By", value=ctx.author.mention, inline=True)
-                embed.add_field(name="Closure Method", value="Command + Auto-Delete", inline=True)
-                await log_channel.send(embed=embed)
-            print(f"Closed and deleted ticket: {ctx.channel.name} ({ctx.channel.id}) by {ctx.author.name}")
+            if enqueue_close(ctx.channel, ctx.author, "command"):
+                await original_message_sent.edit(content="🔒 Closing ticket... Starting countdown to deletion.", view=None)
+            else:
+                await original_message_sent.edit(content="🔒 This ticket is already being closed.", view=None)
         elif view.value is False:
             await original_message_sent.edit(content="Ticket close canceled.", view=None)
         else:
             await original_message_sent.edit(content="Ticket close confirmation timed out.", view=None)
     else:
-        await ctx.send("This command can only be used in ticket channels.")
+        await ctx.send("This command can only be used in ticket channels.", ephemeral=True)
+
+# --- Bulk Ticket Operations ---
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+def parse_duration(text):
+    """Parses durations such as "90m", "12h", "3d" or "1h30m" into seconds. Returns None if invalid."""
+    parts = re.findall(r"(\d+)([smhd])", text.lower())
+    if not parts or "".join(number + unit for number, unit in parts) != text.lower():
+        return None
+    return sum(int(number) * DURATION_UNITS[unit] for number, unit in parts)
+
+async def bulk_close_tickets(guild, channels, closer, reason):
+    """
+    Closes many ticket channels at once. Returns (closed, failed) channel name lists.
+
+    Transcripts are exported, then channels deleted, with at most
+    BULK_CLOSE_CONCURRENCY requests in flight so discord.py's per-route rate
+    limiting can pace them. There is no countdown and no per-ticket log embed;
+    close jobs, ticket records and stats are each written once for the whole
+    batch. Channels that fail to delete get their ticket record back and
+    their close job, already past the transcript stage, is handed to the
+    close workers, which retry just the deletion.
+    """
+    channels = [channel for channel in channels if channel.id not in CLOSE_JOBS]
+    requested_at = time.time()
+    closer_is_staff = is_staff_or_owner(closer)
+    jobs = []
+    for channel in channels:
+        ticket_timers.cancel(channel.id)
+        job = make_close_job(channel, closer, "bulk", requested_at, closer_is_staff)
+        CLOSE_JOBS[channel.id] = job
+        jobs.append(job)
+    store_write("upsert_close_jobs", ticket_store.upsert_close_jobs, [dict(job) for job in jobs])
+
+    semaphore = asyncio.Semaphore(BULK_CLOSE_CONCURRENCY)
+
+    async def export(channel):
+        async with semaphore:
+            await create_transcript(channel, closer)
+
+    async def delete(channel):
+        async with semaphore:
+            try:
+                await channel.delete(reason=reason)
+            except discord.NotFound:
+                pass
+            except Exception:
+                log.exception("Error deleting ticket channel during bulk close", extra={"ticket_id": channel.id, "guild_id": guild.id, "user_id": closer.id})
+                return False
+            return True
+
+    await asyncio.gather(*(export(channel) for channel in channels))
+    # Exported: a retry after a failed delete must not export again
+    exported_at = time.time()
+    for job in jobs:
+        job["stage"] = "delete"
+        job["delete_at"] = exported_at
+    store_write("upsert_close_jobs", ticket_store.upsert_close_jobs, [dict(job) for job in jobs])
+    # Drop the records before deleting so on_guild_channel_delete has nothing left to write
+    records = {record["channel_id"]: record for record in remove_tickets([channel.id for channel in channels])}
+    results = await asyncio.gather(*(delete(channel) for channel in channels))
+
+    closed, failed, finished_ids, retried = [], [], [], []
+    ticket_stats = get_ticket_stats(guild.id)
+    closed_at = time.time()
+    for channel, deleted, job in zip(channels, results, jobs):
+        if not deleted:
+            # Still tracked: the record keeps it a ticket (not an orphan) until a worker deletes it
+            failed.append(channel.name)
+            retried.append(job)
+            continue
+        CLOSE_JOBS.pop(channel.id, None)
+        closed.append(channel.name)
+        finished_ids.append(channel.id)
+        record = records.get(channel.id)
+        if record is not None:
+            ticket_stats.record_close(closed_at, "bulk", closer.id, record["created_at"], closer_is_staff)
+        CLOSE_PIPELINE_SECONDS.observe(closed_at - requested_at, method="bulk")
+    store_write("delete_close_jobs", ticket_store.delete_close_jobs, finished_ids)
+    if retried:
+        save_tickets([records[job["channel_id"]] for job in retried if job["channel_id"] in records])
+        for job in retried:
+            close_queue.put_nowait(job)
+    if records:
+        save_ticket_stats(guild.id)
+    log.info("Bulk close finished: %d closed, %d failed", len(closed), len(failed), extra={"guild_id": guild.id, "user_id": closer.id})
+    return closed, failed
+
+def bulk_summary_embed(title, closed, failed, closer, extra_lines=()):
+    embed = discord.Embed(title=title, color=discord.Color.orange() if failed else discord.Color.green())
+    embed.add_field(name="Closed", value=str(len(closed)), inline=True)
+    embed.add_field(name="Failed", value=str(len(failed)), inline=True)
+    embed.add_field(name="Action By", value=closer.mention, inline=True)
+    details = list(extra_lines)
+    if failed:
+        details.append("Failed: " + ", ".join(f"`{name}`" for name in failed[:20]) + (" ..." if len(failed) > 20 else ""))
+    if details:
+        embed.add_field(name="Details", value="\n".join(details)[:1024], inline=False)
+    return embed
+
+async def send_bulk_summary(ctx, embed):
+    try:
+        await ctx.send(embed=embed)
+    except discord.NotFound:
+        pass  # The command was run in one of the channels that were just deleted
+
+async def confirm_and_bulk_close(ctx, channels, prompt, title, reason):
+    """Asks for confirmation, closes channels in bulk and posts one summary to the log channel."""
+    if not channels:
+        await ctx.send("No matching tickets to close.")
+        return
+    prompt_message = await ctx.send(f"{prompt} This will export transcripts and delete **{len(channels)}** ticket channel(s).")
+    view = ConfirmView(ctx.author.id)
+    await prompt_message.edit(view=view)
+    await view.wait()
+    if view.value is not True:
+        await prompt_message.edit(content="Bulk close canceled." if view.value is False else "Bulk close confirmation timed out.", view=None)
+        return
+
+    await prompt_message.edit(content=f"🔒 Closing {len(channels)} ticket(s)...", view=None)
+    closed, failed = await bulk_close_tickets(ctx.guild, channels, ctx.author, reason)
+    embed = bulk_summary_embed(title, closed, failed, ctx.author)
+    get_guild_config(ctx.guild.id).log_sink.post(embed=embed)
+    await send_bulk_summary(ctx, embed)
+
+def guild_ticket_channels(guild, predicate):
+    """Returns the live channels of this guild's tickets whose record matches predicate."""
+    channels = []
+    for channel_id, record in TICKETS.items():
+        if record["guild_id"] == guild.id and channel_id not in CLOSE_JOBS and predicate(record):
+            channel = guild.get_channel(channel_id)
+            if channel is not None:
+                channels.append(channel)
+    return channels
+
+@bot.command()
+@commands.guild_only()
+@commands.has_permissions(manage_channels=True)
+async def closeidle(ctx, idle_for: str):
+    """
+    Closes every ticket with no activity for longer than the given duration.
+    Usage: !closeidle <duration>
+    Example: !closeidle 12h
+    """
+    seconds = parse_duration(idle_for)
+    if seconds is None:
+        await ctx.send("❌ Invalid duration. Use a number with s, m, h or d, e.g. `90m`, `12h` or `1d12h`.")
+        return
+    cutoff = time.time() - seconds
+    channels = guild_ticket_channels(ctx.guild, lambda record: record["last_activity"] < cutoff)
+    await confirm_and_bulk_close(
+        ctx, channels,
+        f"Close all tickets idle for more than {format_duration(seconds)}?",
+        f"🧹 Bulk Close: Idle > {format_duration(seconds)}",
+        f"Bulk close by {ctx.author.name}: idle for more than {format_duration(seconds)}"
+    )
 
-# --- Add User to Ticket Command ---
 @bot.command()
+@commands.guild_only()
+@commands.has_permissions(manage_channels=True)
+async def closecategory(ctx, category_key: str):
+    """
+    Closes every ticket in a category.
+    Usage: !closecategory <category_key>
+    Example: !closecategory claims
+    """
+    categories = get_guild_config(ctx.guild.id).categories
+    if category_key not in categories:
+        await ctx.send(f"❌ Invalid category key. Available categories: {', '.join(categories.keys())}")
+        return
+    label = categories[category_key]["label"]
+    channels = guild_ticket_channels(ctx.guild, lambda record: record["category"] == category_key)
+    await confirm_and_bulk_close(
+        ctx, channels,
+        f"Close all tickets in the '{label}' category?",
+        f"🧹 Bulk Close: {label}",
+        f"Bulk close by {ctx.author.name}: category {label}"
+    )
+
+@bot.command()
+@commands.guild_only()
+@commands.has_permissions(manage_channels=True)
+async def purgeorphans(ctx):
+    """
+    Cleans up ticket state that no longer lines up with the server.
+
+    Drops records whose channel is gone, closes channels in ticket categories
+    that have no ticket record, and deletes empty overflow categories.
+    """
+    guild = ctx.guild
+    stale_ids = [
+        channel_id for channel_id, record in TICKETS.items()
+        if record["guild_id"] == guild.id and channel_id not in CLOSE_JOBS and guild.get_channel(channel_id) is None
+    ]
+    ticket_categories = [category for category in guild.categories if is_ticket_category(category)]
+    orphan_channels = [
+        channel for category in ticket_categories for channel in category.channels
+        if channel.id not in TICKETS and channel.id not in CLOSE_JOBS
+    ]
+    empty_categories = [
+        category for category in ticket_categories
+        if ticket_category_number(category) > 1 and ticket_category_size(category) == 0
+    ]
+    if not (stale_ids or orphan_channels or empty_categories):
+        await ctx.send("✅ No orphaned tickets found.")
+        return
+
+    if stale_ids:
+        for channel_id in stale_ids:
+            ticket_timers.cancel(channel_id)
+            ticket_event_log.discard(channel_id)
+        remove_tickets(stale_ids)
+
+    deleted_categories = 0
+    for category in empty_categories:
+        try:
+            await category.delete(reason=f"Empty ticket overflow category purged by {ctx.author.name}")
+            deleted_categories += 1
+        except discord.HTTPException:
+            log.exception("Error deleting empty ticket category", extra={"guild_id": guild.id, "user_id": ctx.author.id})
+
+    extra_lines = [f"Stale records removed: {len(stale_ids)}", f"Empty categories deleted: {deleted_categories}"]
+    if orphan_channels:
+        prompt_message = await ctx.send(
+            f"Found **{len(orphan_channels)}** channel(s) in ticket categories without a ticket record. "
+            f"Export their transcripts and delete them?"
+        )
+        view = ConfirmView(ctx.author.id)
+        await prompt_message.edit(view=view)
+        await view.wait()
+        if view.value is True:
+            await prompt_message.edit(content=f"🔒 Closing {len(orphan_channels)} orphaned channel(s)...", view=None)
+            closed, failed = await bulk_close_tickets(guild, orphan_channels, ctx.author, f"Orphaned ticket channel purged by {ctx.author.name}")
+        else:
+            await prompt_message.edit(content="Orphaned channels were left in place.", view=None)
+            closed, failed = [], []
+    else:
+        closed, failed = [], []
+
+    embed = bulk_summary_embed("🧹 Orphan Purge", closed, failed, ctx.author, extra_lines)
+    get_guild_config(guild.id).log_sink.post(embed=embed)
+    await send_bulk_summary(ctx, embed)
+
+# --- Add User to Ticket Command ---
+@bot.hybrid_command()
 @commands.has_permissions(manage_channels=True)
+@app_commands.default_permissions(manage_channels=True)
+@app_commands.guild_only()
+@app_commands.describe(member="Member to add to this ticket")
 async def add(ctx, member: discord.Member):
     """Adds a specified member to the current ticket channel."""
-    log_channel = bot.get_channel(LOG_CHANNEL_ID)
-    if ctx.channel.category and ctx.channel.category.name == "Tickets":
+    if is_ticket_channel(ctx.channel):
+        await ctx.defer(ephemeral=True)
         try:
             await ctx.channel.set_permissions(member, read_messages=True, send_messages=True, embed_links=True, attach_files=True)
-            await ctx.send(f"✅ {member.mention} has been added to this ticket.")
-            if log_channel:
-                embed = discord.Embed(
-                    title="➕ User Added to Ticket",
-                    description=f"{member.mention} has been added to {ctx.channel.mention}.",
-                    color=discord.Color.blue()
-                )
-                embed.add_field(name="Action By", value=ctx.author.mention, inline=True)
-                embed.add_field(name="Ticket Channel", value=ctx.channel.name, inline=True)
-                await log_channel.send(embed=embed)
+            await ctx.send(f"✅ {member.mention} has been added to this ticket.", ephemeral=True)
+            embed = discord.Embed(
+                title="➕ User Added to Ticket",
+                description=f"{member.mention} has been added to {ctx.channel.mention}.",
+                color=discord.Color.blue()
+            )
+            embed.add_field(name="Action By", value=ctx.author.mention, inline=True)
+            embed.add_field(name="Ticket Channel", value=ctx.channel.name, inline=True)
+            get_guild_config(ctx.guild.id).log_sink.post(embed=embed)
         except discord.Forbidden:
-            await ctx.send("❌ I don't have permission to add users to this channel.")
+            await ctx.send("❌ I don't have permission to add users to this channel.", ephemeral=True)
         except Exception as e:
-            await ctx.send(f"❌ An error occurred: {e}")
-            print(f"Error adding user to ticket: {e}", file=sys.stderr)
-            traceback.print_exc()
+            await ctx.send(f"❌ An error occurred: {e}", ephemeral=True)
+            log.exception("Error adding user to ticket", extra={"ticket_id": ctx.channel.id, "guild_id": ctx.guild.id, "user_id": member.id})
     else:
-        await ctx.send("❌ This command can only be used in ticket channels.")
+        await ctx.send("❌ This command can only be used in ticket channels.", ephemeral=True)
 
 # --- Remove User from Ticket Command ---
-@bot.command()
+@bot.hybrid_command()
 @commands.has_permissions(manage_channels=True)
+@app_commands.default_permissions(manage_channels=True)
+@app_commands.guild_only()
+@app_commands.describe(member="Member to remove from this ticket")
 async def remove(ctx, member: discord.Member):
     """Removes a specified member from the current ticket channel."""
-    log_channel = bot.get_channel(LOG_CHANNEL_ID)
-    if ctx.channel.category and ctx.channel.category.name == "Tickets":
-        member_is_staff = any(role.id == STAFF_ROLE_ID for role in member.roles)
-        member_is_owner = any(role.id == OWNER_ROLE_ID for role in member.roles)
-
-        if member_is_staff or member_is_owner or TICKET_CREATOR.get(ctx.channel.id) == member.id:
-            await ctx.send("❌ You cannot remove a staff member, owner, or the original ticket creator from the ticket using this command.")
+    if is_ticket_channel(ctx.channel):
+        if is_staff_or_owner(member) or get_ticket_creator_id(ctx.channel.id) == member.id:
+            await ctx.send("❌ You cannot remove a staff member, owner, or the original ticket creator from the ticket using this command.", ephemeral=True)
             return
 
+        await ctx.defer(ephemeral=True)
         try:
             await ctx.channel.set_permissions(member, read_messages=False, send_messages=False)
-            await ctx.send(f"✅ {member.mention} has been removed from this ticket.")
-            if log_channel:
-                embed = discord.Embed(
-                    title="➖ User Removed from Ticket",
-                    description=f"{member.mention} has been removed from {ctx.channel.mention}.",
-                    color=discord.Color.orange()
-                )
-                embed.add_field(name="Action By", value=ctx.author.mention, inline=True)
-                embed.add_field(name="Ticket Channel", value=ctx.channel.name, inline=True)
-                await log_channel.send(embed=embed)
+            await ctx.send(f"✅ {member.mention} has been removed from this ticket.", ephemeral=True)
+            embed = discord.Embed(
+                title="➖ User Removed from Ticket",
+                description=f"{member.mention} has been removed from {ctx.channel.mention}.",
+                color=discord.Color.orange()
+            )
+            embed.add_field(name="Action By", value=ctx.author.mention, inline=True)
+            embed.add_field(name="Ticket Channel", value=ctx.channel.name, inline=True)
+            get_guild_config(ctx.guild.id).log_sink.post(embed=embed)
         except discord.Forbidden:
-            await ctx.send("❌ I don't have permission to remove users from this channel.")
+            await ctx.send("❌ I don't have permission to remove users from this channel.", ephemeral=True)
         except Exception as e:
-            await ctx.send(f"❌ An error occurred: {e}")
-            print(f"Error removing user from ticket: {e}", file=sys.stderr)
-            traceback.print_exc()
+            await ctx.send(f"❌ An error occurred: {e}", ephemeral=True)
+            log.exception("Error removing user from ticket", extra={"ticket_id": ctx.channel.id, "guild_id": ctx.guild.id, "user_id": member.id})
     else:
-        await ctx.send("❌ This command can only be used in ticket channels.")
+        await ctx.send("❌ This command can only be used in ticket channels.", ephemeral=True)
+
+# --- Stats Command ---
+@bot.command()
+@commands.guild_only()
+async def stats(ctx):
+    """Shows ticket statistics for this server. Staff only."""
+    if not is_staff_or_owner(ctx.author):
+        await ctx.send("❌ You don't have permission to view ticket statistics.")
+        return
+
+    config = get_guild_config(ctx.guild.id)
+    ticket_stats = get_ticket_stats(ctx.guild.id)
+    now = time.time()
+
+    embed = discord.Embed(title="📊 Ticket Statistics", color=discord.Color.blue())
+    open_counts = {key: OPEN_TICKET_COUNTS[(ctx.guild.id, key)] for key in config.categories}
+    open_lines = [f"{data['label']}: **{open_counts[key]}**" for key, data in config.categories.items() if open_counts[key]]
+    embed.add_field(name=f"Open Tickets ({sum(open_counts.values())})", value="\n".join(open_lines) or "None", inline=False)
+
+    last_hour = ticket_stats.window_counts(now, 1)
+    last_day = ticket_stats.window_counts(now, GuildTicketStats.HOURLY_WINDOW)
+    embed.add_field(name="Last Hour", value=f"Opened: **{last_hour[0]}**\nClosed: **{last_hour[1]}**", inline=True)
+    embed.add_field(name="Last 24 Hours", value=f"Opened: **{last_day[0]}**\nClosed: **{last_day[1]}**", inline=True)
+    embed.add_field(name="All Time", value=f"Opened: **{ticket_stats.opened_total}**\nClosed: **{ticket_stats.closed_total}**", inline=True)
+
+    median = ticket_stats.time_to_close.quantile(0.5)
+    p90 = ticket_stats.time_to_close.quantile(0.9)
+    embed.add_field(
+        name="Time to Close",
+        value=f"Median: **{format_duration(median)}**\n90th percentile: **{format_duration(p90)}**" if median is not None else "No closed tickets yet",
+        inline=True
+    )
+    auto_closed = ticket_stats.closed_by_method["auto"]
+    auto_close_rate = f"{auto_closed / ticket_stats.closed_total:.0%} ({auto_closed}/{ticket_stats.closed_total})" if ticket_stats.closed_total else "n/a"
+    embed.add_field(name="Auto-Close Rate", value=auto_close_rate, inline=True)
+
+    busiest = ticket_stats.closes_by_staff.most_common(3)
+    embed.add_field(
+        name="Busiest Staff",
+        value="\n".join(f"<@{user_id}>: **{count}** closed" for user_id, count in busiest) or "No closes yet",
+        inline=False
+    )
+    await ctx.send(embed=embed)
 
 # --- Transcript Function ---
+class TranscriptExporter:
+    """
+    Streams transcript lines into in-memory attachment parts.
+
+    Lines are encoded, and optionally gzip-compressed, as they arrive. When the
+    next line would push the current part past max_bytes, the part is closed and
+    handed to on_part, so memory stays bounded by one part no matter how long
+    the ticket is. Nothing is written to disk.
+    """
+
+    FLUSH_EVERY = 64 * 1024  # Uncompressed bytes fed to the compressor between sync flushes
+
+    def __init__(self, basename, max_bytes, on_part, compress=False):
+        self.basename = basename
+        self.max_bytes = max_bytes
+        self.on_part = on_part  # async callable(part_number, discord.File)
+        self.compress = compress
+        self.part_number = 0
+        self.split = False
+        self.total_bytes = 0
+        self._start_part()
+
+    def _start_part(self):
+        self.part_number += 1
+        self.buffer = io.BytesIO()
+        self.part_lines = 0
+        self.unflushed = 0
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if self.compress else None
+
+    def _projected_size(self, line_bytes):
+        # Bytes still buffered inside the compressor are counted uncompressed, which keeps the bound safe
+        return self.buffer.tell() + self.unflushed + len(line_bytes) + 64
+
+    async def write_line(self, line):
+        line_bytes = (line + "\n").encode('utf-8')
+        if self.part_lines and self._projected_size(line_bytes) > self.max_bytes:
+            self.split = True
+            await self._emit_part()
+            self._start_part()
+
+        if self.compressor:
+            self.buffer.write(self.compressor.compress(line_bytes))
+            self.unflushed += len(line_bytes)
+            if self.unflushed >= self.FLUSH_EVERY:
+                self.buffer.write(self.compressor.flush(zlib.Z_SYNC_FLUSH))
+                self.unflushed = 0
+        else:
+            self.buffer.write(line_bytes)
+        self.part_lines += 1
+
+    async def _emit_part(self):
+        if self.compressor:
+            self.buffer.write(self.compressor.flush())
+            self.unflushed = 0
+        suffix = f"-part{self.part_number}" if self.split else ""
+        extension = ".txt.gz" if self.compress else ".txt"
+        self.total_bytes += self.buffer.tell()
+        self.buffer.seek(0)
+        await self.on_part(self.part_number, discord.File(self.buffer, filename=f"{self.basename}{suffix}{extension}"))
+
+    async def finish(self):
+        """Emits the last part. Returns the number of parts produced."""
+        if self.part_lines:
+            await self._emit_part()
+            return self.part_number
+        return self.part_number - 1
+
+def transcript_entry(msg):
+    """Captures what a transcript needs from a message as a JSON-serializable dict."""
+    embed_info = []
+    for embed in msg.embeds:
+        embed_title = f"Title: {embed.title}" if embed.title else "No Title"
+        embed_description = f"Description: {embed.description}" if embed.description else "No Description"
+        embed_url = f"URL: {embed.url}" if embed.url else "No URL"
+        embed_info.append(f"Embed: ({embed_title}, {embed_description}, {embed_url})")
+    return {
+        "id": msg.id,
+        "created_at": msg.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        "author": msg.author.display_name,
+        "author_id": msg.author.id,
+        "content": msg.clean_content,
+        "attachments": [att.url for att in msg.attachments],
+        "embeds": embed_info
+    }
+
+def format_transcript_entry(entry):
+    """Formats a captured message as a transcript entry."""
+    archived = entry.get("archived", {})
+    attachments = "\n".join([
+        f"Attachment: {url}" + (f" (archived: {archived[url]})" if url in archived else "")
+        for url in entry["attachments"]
+    ])
+    embeds = "\n".join(entry["embeds"])
+
+    content = f"[{entry['created_at']}] {entry['author']} ({entry['author_id']}): {entry['content']}"
+    if attachments:
+        content += f"\n{attachments}"
+    if embeds:
+        content += f"\n{embeds}"
+    return content
+
+async def iter_ticket_history(channel):
+    """
+    Yields transcript entries for a ticket channel, oldest first.
+
+    Entries come from the ticket's event log, with edits and deletions applied.
+    Only the gaps the log cannot cover are fetched from the API: the span
+    around each "resume" marker (the bot was offline) and anything after the
+    last captured message. Tickets without a complete log fall back to the
+    full channel history.
+    """
+    has_open = False
+    edits = {}
+    deleted = set()
+    archived = {}  # attachment URL -> link to the archived copy
+    async for event in ticket_event_log.events(channel.id):
+        if event["op"] == "open":
+            has_open = True
+        elif event["op"] == "edit":
+            edits[event["entry"]["id"]] = event["entry"]
+        elif event["op"] == "delete":
+            deleted.update(event["ids"])
+        elif event["op"] == "archive" and attachment_archiver:
+            archived[event["url"]] = attachment_archiver.link(event["path"])
+
+    def link_archived(entry):
+        links = {url: archived[url] for url in entry["attachments"] if url in archived}
+        return {**entry, "archived": links} if links else entry
+
+    if not has_open:
+        async for msg in channel.history(limit=None, oldest_first=True):
+            yield link_archived(transcript_entry(msg))
+        return
+
+    def apply_changes(entry):
+        return None if entry["id"] in deleted else link_archived(edits.get(entry["id"], entry))
+
+    async def fetch_gap(after_id, before_id=None):
+        after = discord.Object(id=after_id) if after_id else None
+        before = discord.Object(id=before_id) if before_id else None
+        async for msg in channel.history(limit=None, after=after, before=before, oldest_first=True):
+            entry = apply_changes(transcript_entry(msg))
+            if entry:
+                yield entry
+
+    last_id = None
+    gap_pending = False
+    async for event in ticket_event_log.events(channel.id):
+        if event["op"] == "resume":
+            gap_pending = True
+        elif event["op"] == "message":
+            entry = event["entry"]
+            if last_id is not None and entry["id"] <= last_id:
+                continue  # Already emitted from a gap fetch
+            if gap_pending:
+                async for gap_entry in fetch_gap(last_id, entry["id"]):
+                    yield gap_entry
+                gap_pending = False
+            last_id = entry["id"]
+            entry = apply_changes(entry)
+            if entry:
+                yield entry
+
+    async for gap_entry in fetch_gap(last_id):
+        yield gap_entry
+
 async def create_transcript(channel, closer, auto_closed=False):
-    """Creates a transcript of the ticket channel and sends it to the log channel."""
-    log_channel = bot.get_channel(LOG_CHANNEL_ID)
+    """Streams a transcript of the ticket channel to the log channel, split into parts if needed."""
+    config = get_guild_config(channel.guild.id)
+    log_channel = bot.get_channel(config.log_channel_id)
     if not log_channel:
-        print("Log channel not found for transcript.")
+        log.warning("Log channel not found for transcript.", extra={"ticket_id": channel.id, "guild_id": channel.guild.id})
         return
 
     if not bot.get_channel(channel.id):
-        print(f"Channel {channel.id} no longer exists, cannot create transcript.")
+        log.warning("Channel no longer exists, cannot create transcript.", extra={"ticket_id": channel.id, "guild_id": channel.guild.id})
         return
 
-    transcript_content = []
-    transcript_content.append(f"--- Ticket Transcript for #{channel.name} (ID: {channel.id}) ---")
-    ticket_creator_id_val = TICKET_CREATOR.get(channel.id)
-    if ticket_creator_id_val:
-        creator_member = channel.guild.get_member(ticket_creator_id_val)
-        creator_name = creator_member.display_name if creator_member else f"Unknown User (ID: {ticket_creator_id_val})"
-        transcript_content.append(f"Opened by: {creator_name} (ID: {ticket_creator_id_val})")
-    else:
-        transcript_content.append(f"Opened by: Unknown User (ID not found in TICKET_CREATOR)")
+    ticket_creator_id_val = get_ticket_creator_id(channel.id)
+    ticket_creator_mention = f"<@{ticket_creator_id_val}>" if ticket_creator_id_val else "Unknown User"
+    closure_type = "Auto-Closed (Inactivity)" if auto_closed else "Manually Closed"
+    embed = discord.Embed(
+        title=f"Ticket Transcript: #{channel.name}",
+        description=f"Ticket created by: {ticket_creator_mention}\nClosed by: {closer.mention}",
+        color=discord.Color.blue()
+    )
+    embed.add_field(name="Closure Type", value=closure_type, inline=True)
 
-    transcript_content.append(f"Closed by: {closer.name} (ID: {closer.id})")
-    transcript_content.append(f"Timestamp: {discord.utils.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')}\n")
+    async def send_part(part_number, file):
+        if part_number == 1:
+            await config.log_sink.post_file(file, embed=embed)
+        else:
+            await config.log_sink.post_file(file, content=f"Transcript for `#{channel.name}` (part {part_number})")
 
-    try:
-        async for msg in channel.history(limit=None, oldest_first=True):
-            attachments = "\n".join([f"Attachment: {att.url}" for att in msg.attachments])
-            embed_info = []
-            for embed in msg.embeds:
-                embed_title = f"Title: {embed.title}" if embed.title else "No Title"
-                embed_description = f"Description: {embed.description}" if embed.description else "No Description"
-                embed_url = f"URL: {embed.url}" if embed.url else "No URL"
-                embed_info.append(f"Embed: ({embed_title}, {embed_description}, {embed_url})")
-            embeds = "\n".join(embed_info)
-
-            content = f"[{msg.created_at.strftime('%Y-%m-%d %H:%M:%S')}] {msg.author.display_name} ({msg.author.id}): {msg.clean_content}"
-            if attachments:
-                content += f"\n{attachments}"
-            if embeds:
-                content += f"\n{embeds}"
-            transcript_content.append(content)
-
-        transcript_filename = f"transcript-{channel.name}-{channel.id}.txt"
-        with open(transcript_filename, 'w', encoding='utf-8') as f:
-            f.write("\n".join(transcript_content))
-
-        file = discord.File(transcript_filename)
-        ticket_creator_mention = f"<@{ticket_creator_id_val}>" if ticket_creator_id_val else "Unknown User"
+    exporter = TranscriptExporter(
+        f"transcript-{channel.name}-{channel.id}",
+        min(TRANSCRIPT_PART_LIMIT, log_channel.guild.filesize_limit),
+        send_part,
+        compress=TRANSCRIPT_COMPRESS
+    )
 
-        embed = discord.Embed(
-            title=f"Ticket Transcript: #{channel.name}",
-            description=f"Ticket created by: {ticket_creator_mention}\nClosed by: {closer.mention}",
-            color=discord.Color.blue()
-        )
-        if auto_closed:
-            embed.add_field(name="Closure Type", value="Auto-Closed (Inactivity)", inline=True)
+    archive_body = TranscriptArchive.body_builder() if transcript_archive else None
+    creator_name = "Unknown User"
+    export_started = time.perf_counter()
+    try:
+        await exporter.write_line(f"--- Ticket Transcript for #{channel.name} (ID: {channel.id}) ---")
+        if ticket_creator_id_val:
+            creator_member = await member_cache.resolve(channel.guild, ticket_creator_id_val)
+            creator_name = creator_member.display_name if creator_member else f"Unknown User (ID: {ticket_creator_id_val})"
+            await exporter.write_line(f"Opened by: {creator_name} (ID: {ticket_creator_id_val})")
         else:
-            embed.add_field(name="Closure Type", value="Manually Closed", inline=True)
-
-        await log_channel.send(embed=embed, file=file)
-        os.remove(transcript_filename)
+            await exporter.write_line(f"Opened by: Unknown User (no ticket record found)")
+        await exporter.write_line(f"Closed by: {closer.name} (ID: {closer.id})")
+        await exporter.write_line(f"Timestamp: {discord.utils.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')}\n")
+
+        async for entry in iter_ticket_history(channel):
+            line = format_transcript_entry(entry)
+            await exporter.write_line(line)
+            if archive_body:
+                archive_body.add(line)
+
+        await exporter.finish()
+        TRANSCRIPT_EXPORT_SECONDS.observe(time.perf_counter() - export_started)
+        TRANSCRIPT_EXPORT_BYTES.observe(exporter.total_bytes)
+        if attachment_archiver:
+            attachment_archiver.forget(channel.id)
+        ticket_event_log.discard(channel.id)
+        if transcript_archive:
+            record = TICKETS.get(channel.id)
+            transcript_archive.submit({
+                "guild_id": channel.guild.id,
+                "channel_id": channel.id,
+                "channel_name": channel.name,
+                "category": config.categories.get(record["category"], {}).get("label", record["category"]) if record and record["category"] else None,
+                "creator_id": ticket_creator_id_val,
+                "creator_name": creator_name,
+                "closer_id": closer.id,
+                "closer_name": closer.name,
+                "closure": closure_type,
+                "closed_at": time.time()
+            }, archive_body.text())
 
     except discord.Forbidden:
-        print(f"I don't have permission to read message history or send files in {log_channel.name}.")
-    except Exception as e:
-        print(f"Error creating or sending transcript for {channel.name}: {e}", file=sys.stderr)
-        traceback.print_exc()
+        log.error("Missing permission to read message history or send files in %s.", log_channel.name, extra={"ticket_id": channel.id, "guild_id": channel.guild.id})
+    except Exception:
+        log.exception("Error creating or sending transcript for %s", channel.name, extra={"ticket_id": channel.id, "guild_id": channel.guild.id})
 
-# --- Ping Ticket Creator Command ---
+# --- Transcript Archive ---
+class TranscriptArchive:
+    """
+    Local, searchable copy of every exported transcript.
+
+    Each transcript is one row of an SQLite FTS5 table whose columns are the
+    transcript text plus its creator, closer, category and closure type, so a
+    search can match message text or narrow with column:value terms. Writes,
+    retention and compaction run in order on the archive's own thread (so a
+    large compaction never delays ticket store writes); searches use
+    per-thread read connections on the I/O pool, which WAL mode lets run
+    alongside writes.
+    """
+
+    MAX_BODY_CHARS = 5_000_000  # Text indexed per transcript; the attached file always has everything
+    SEARCH_COLUMNS = ("body", "creator", "closer", "category", "closure")
+
+    class BodyBuilder:
+        def __init__(self, limit):
+            self.lines = []
+            self.remaining = limit
+
+        def add(self, line):
+            if self.remaining > 0:
+                self.lines.append(line[:self.remaining])
+                self.remaining -= len(line) + 1
+
+        def text(self):
+            return "\n".join(self.lines)
+
+    @classmethod
+    def body_builder(cls):
+        return cls.BodyBuilder(cls.MAX_BODY_CHARS)
+
+    def __init__(self, path, retention_days=TRANSCRIPT_RETENTION_DAYS):
+        self.path = path
+        self.retention_days = retention_days
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="transcript-archive")
+        self.conn = None  # Writer connection, opened on the archive thread
+        self.readers = threading.local()
+
+    def _connection(self):
+        if self.conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")  # Only takes effect on a new database
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS transcripts ("
+                    "id INTEGER PRIMARY KEY, guild_id INTEGER NOT NULL, channel_id INTEGER NOT NULL, "
+                    "channel_name TEXT, category TEXT, creator_id INTEGER, creator_name TEXT, "
+                    "closer_id INTEGER, closer_name TEXT, closure TEXT, closed_at REAL NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS transcripts_closed_at ON transcripts (closed_at)")
+                conn.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS transcript_fts "
+                    f"USING fts5({', '.join(self.SEARCH_COLUMNS)}, tokenize='unicode61')"
+                )
+            self.conn = conn
+        return self.conn
+
+    def _reader(self):
+        conn = getattr(self.readers, "conn", None)
+        if conn is None:
+            conn = self.readers.conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        return conn
+
+    async def open(self):
+        """Creates the archive database if needed; searches need it to exist."""
+        await asyncio.wrap_future(self.executor.submit(self._connection))
+
+    def submit(self, metadata, body):
+        """Queues a transcript for indexing without waiting for it."""
+        future = self.executor.submit(self._add, metadata, body)
+        future.add_done_callback(log_write_failure)
+        return future
+
+    def _add(self, metadata, body):
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO transcripts (guild_id, channel_id, channel_name, category, creator_id, creator_name, "
+                "closer_id, closer_name, closure, closed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (metadata["guild_id"], metadata["channel_id"], metadata["channel_name"], metadata["category"],
+                 metadata["creator_id"], metadata["creator_name"], metadata["closer_id"], metadata["closer_name"],
+                 metadata["closure"], metadata["closed_at"])
+            )
+            conn.execute(
+                "INSERT INTO transcript_fts (rowid, body, creator, closer, category, closure) VALUES (?, ?, ?, ?, ?, ?)",
+                (cursor.lastrowid, body, f"{metadata['creator_name']} {metadata['creator_id'] or ''}",
+                 f"{metadata['closer_name']} {metadata['closer_id']}", metadata["category"] or "", metadata["closure"])
+            )
+
+    @classmethod
+    def match_expression(cls, query):
+        """
+        Turns user input into an FTS5 query: every term is quoted so punctuation
+        in hashes or addresses is literal, "column:value" narrows to a metadata
+        column and a trailing * keeps prefix matching.
+        """
+        terms = []
+        for token in query.split():
+            column, separator, value = token.partition(":")
+            if separator and value and column.lower() in cls.SEARCH_COLUMNS:
+                column_filter, token = f"{column.lower()}:", value
+            else:
+                column_filter = ""
+            star = ""
+            if token.endswith("*") and len(token) > 1:
+                token, star = token[:-1], "*"
+            quoted = '"' + token.replace('"', '""') + '"'
+            terms.append(f"{column_filter}{quoted}{star}")
+        return " ".join(terms)
+
+    async def search(self, guild_id, query, limit=5):
+        """
+        Returns up to limit matching transcripts for the guild, newest first, with snippets.
+
+        Newest-first walks the index in rowid order and stops at limit, so common
+        terms stay fast; ranking by relevance would score every match.
+        """
+        return await run_io(self._search, guild_id, self.match_expression(query), limit)
+
+    def _search(self, guild_id, expression, limit):
+        rows = self._reader().execute(
+            "SELECT t.channel_name, t.channel_id, t.creator_id, t.closer_id, t.category, t.closure, t.closed_at, "
+            "snippet(transcript_fts, 0, '**', '**', ' … ', 24) "
+            "FROM transcript_fts JOIN transcripts t ON t.id = transcript_fts.rowid "
+            "WHERE transcript_fts MATCH ? AND t.guild_id = ? ORDER BY transcript_fts.rowid DESC LIMIT ?",
+            (expression, guild_id, limit)
+        ).fetchall()
+        keys = ("channel_name", "channel_id", "creator_id", "closer_id", "category", "closure", "closed_at", "snippet")
+        results = [dict(zip(keys, row)) for row in rows]
+        for result in results:
+            result["snippet"] = " ".join(result["snippet"].split())
+        return results
+
+    async def maintain(self):
+        """Applies retention, then compacts the index and database. Returns the number of transcripts removed."""
+        return await asyncio.wrap_future(self.executor.submit(self._maintain))
+
+    def _maintain(self):
+        conn = self._connection()
+        removed = 0
+        if self.retention_days:
+            cutoff = time.time() - self.retention_days * 86400
+            with conn:
+                conn.execute("DELETE FROM transcript_fts WHERE rowid IN (SELECT id FROM transcripts WHERE closed_at < ?)", (cutoff,))
+                removed = conn.execute("DELETE FROM transcripts WHERE closed_at < ?", (cutoff,)).rowcount
+        with conn:
+            conn.execute("INSERT INTO transcript_fts (transcript_fts) VALUES ('optimize')")  # Merge index segments
+        conn.executescript("PRAGMA incremental_vacuum;")  # executescript steps it to completion; execute() frees one page
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return removed
+
+transcript_archive = TranscriptArchive(TRANSCRIPT_ARCHIVE_FILE) if TRANSCRIPT_ARCHIVE_FILE else None
+transcript_archive_maintainer = None  # Task running maintain_transcript_archive()
+
+async def maintain_transcript_archive():
+    """Runs retention and compaction on the transcript archive now and every few hours."""
+    while True:
+        try:
+            removed = await transcript_archive.maintain()
+            log.info("Transcript archive maintenance removed %d expired transcripts.", removed)
+        except Exception:
+            log.exception("Error during transcript archive maintenance")
+        await asyncio.sleep(TRANSCRIPT_ARCHIVE_MAINTENANCE_INTERVAL)
+
+# --- Search Command ---
 @bot.command()
+@commands.guild_only()
+async def search(ctx, *, query: str):
+    """
+    Searches archived transcripts for this server. Staff only.
+    Usage: !search <terms>
+    Example: !search creator:alice ltc1q*
+    """
+    if not is_staff_or_owner(ctx.author):
+        await ctx.send("❌ You don't have permission to search transcripts.")
+        return
+    if not transcript_archive:
+        await ctx.send("❌ The transcript archive is disabled.")
+        return
+
+    started = time.perf_counter()
+    try:
+        results = await transcript_archive.search(ctx.guild.id, query)
+    except sqlite3.OperationalError as e:
+        await ctx.send(f"❌ Invalid search: {e}")
+        return
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    if not results:
+        await ctx.send(f"No archived transcripts match `{query}`.")
+        return
+    embed = discord.Embed(title=f"🔎 Transcript Search: {query}"[:256], color=discord.Color.blue())
+    for result in results:
+        creator = f"<@{result['creator_id']}>" if result["creator_id"] else "Unknown User"
+        details = f"Creator: {creator} · Closed by: <@{result['closer_id']}> · {result['category'] or 'No category'} · {result['closure']}"
+        embed.add_field(
+            name=f"#{result['channel_name']} ({result['channel_id']})"[:256],
+            value=f"{details}\nClosed <t:{int(result['closed_at'])}:R>\n> {result['snippet']}"[:1024],
+            inline=False
+        )
+    embed.set_footer(text=f"{len(results)} result(s) in {elapsed_ms:.1f} ms")
+    await ctx.send(embed=embed)
+
+# --- Ping Ticket Creator Command ---
+@bot.hybrid_command()
 @commands.has_permissions(manage_channels=True)
+@app_commands.default_permissions(manage_channels=True)
+@app_commands.guild_only()
 async def ping(ctx):
     """Pings the creator of the current ticket."""
-    if ctx.channel.id in TICKET_CREATOR:
-        user_id = TICKET_CREATOR[ctx.channel.id]
-        user = ctx.guild.get_member(user_id)
+    if ctx.channel.id in TICKETS:
+        await ctx.defer(ephemeral=True)
+        user_id = TICKETS[ctx.channel.id]["creator_id"]
+        user = await member_cache.resolve(ctx.guild, user_id)
 
         if user is None:
             try:
                 user = await bot.fetch_user(user_id)
             except discord.NotFound:
-                await ctx.send("❌ The ticket creator could not be found.")
+                await ctx.send("❌ The ticket creator could not be found.", ephemeral=True)
                 return
             except Exception as e:
-                await ctx.send(f"❌ An error occurred while trying to fetch the user: {e}")
+                await ctx.send(f"❌ An error occurred while trying to fetch the user: {e}", ephemeral=True)
                 return
 
         if user:
             try:
                 await user.send(f"👋 {ctx.author.mention} asked you to check your ticket in {ctx.channel.mention}. Please review your ticket channel.")
-                await ctx.send(f"✅ DM sent to the ticket creator ({user.mention})!")
+                await ctx.send(f"✅ DM sent to the ticket creator ({user.mention})!", ephemeral=True)
             except discord.Forbidden:
-                await ctx.send("❌ I couldn't DM the user. They might have DMs disabled or blocked me.")
+                await ctx.send("❌ I couldn't DM the user. They might have DMs disabled or blocked me.", ephemeral=True)
             except Exception as e:
-                await ctx.send(f"❌ An error occurred while trying to DM the user: {e}")
+                await ctx.send(f"❌ An error occurred while trying to DM the user: {e}", ephemeral=True)
         else:
-            await ctx.send("❌ The ticket creator could not be found.")
+            await ctx.send("❌ The ticket creator could not be found.", ephemeral=True)
     else:
-        await ctx.send("❌ No ticket creator data found for this channel. This command must be used in a ticket channel.")
+        await ctx.send("❌ No ticket creator data found for this channel. This command must be used in a ticket channel.", ephemeral=True)
 
 # --- New General Ping Command ---
-@bot.command()
+@bot.hybrid_command()
 @commands.has_permissions(manage_channels=True)
+@app_commands.default_permissions(manage_channels=True)
+@app_commands.guild_only()
+@app_commands.describe(member="Member to notify about this ticket")
 async def ticketping(ctx, member: discord.Member):
     """Pings a specified member regarding the current ticket channel.
     The user will receive a DM and a message in the ticket channel.
     Usage: !ticketping <@user_mention>
     """
-    if not ctx.channel.category or ctx.channel.category.name != "Tickets":
-        await ctx.send("❌ This command can only be used in ticket channels.")
+    if not is_ticket_channel(ctx.channel):
+        await ctx.send("❌ This command can only be used in ticket channels.", ephemeral=True)
         return
 
+    await ctx.defer(ephemeral=True)
     try:
         # DM the user
         await member.send(
             f"👋 {ctx.author.mention} from **{ctx.guild.name}** asked you to check the ticket "
             f"{ctx.channel.mention}. Please review the ticket channel."
         )
-        # Confirm in the ticket channel
-        await ctx.send(f"✅ DM sent to {member.mention} regarding this ticket!")
+        # Confirm to the caller (only they see it when invoked as a slash command)
+        await ctx.send(f"✅ DM sent to {member.mention} regarding this ticket!", ephemeral=True)
     except discord.Forbidden:
-        await ctx.send(f"❌ I couldn't DM {member.mention}. They might have DMs disabled or blocked me.")
+        await ctx.send(f"❌ I couldn't DM {member.mention}. They might have DMs disabled or blocked me.", ephemeral=True)
     except Exception as e:
-        await ctx.send(f"❌ An error occurred while trying to ping {member.mention}: {e}")
-        print(f"Error pinging user {member.id} in ticket {ctx.channel.id}: {e}", file=sys.stderr)
-        traceback.print_exc()
+        await ctx.send(f"❌ An error occurred while trying to ping {member.mention}: {e}", ephemeral=True)
+        log.exception("Error pinging ticket member", extra={"ticket_id": ctx.channel.id, "guild_id": ctx.guild.id, "user_id": member.id})
 
 # --- Payment Commands (Simple link only) ---
-@bot.command()
+async def send_payment_link(ctx, method_id):
+    """Posts a payment link. Unlike the staff tools this reply is public: it is meant for the customer."""
+    method_data = get_guild_config(ctx.guild.id if ctx.guild else None).payment_methods.get(method_id)
+    if method_data:
+        await ctx.defer()
+        await ctx.send(method_data["link"])
+    else:
+        await ctx.send("❌ This payment method is not configured for this server.", ephemeral=True)
+
+@bot.hybrid_command()
 async def pp(ctx):
     """Displays PayPal payment link only."""
-    await ctx.send(PAYMENT_METHODS["paypal"]["link"])
+    await send_payment_link(ctx, "paypal")
 
-@bot.command()
+@bot.hybrid_command()
 async def cash(ctx):
     """Displays Cash App payment link only."""
-    await ctx.send(PAYMENT_METHODS["cashapp"]["link"])
+    await send_payment_link(ctx, "cashapp")
 
-@bot.command()
+@bot.hybrid_command()
 async def ltc(ctx):
     """Displays Litecoin address only."""
-    await ctx.send(PAYMENT_METHODS["litecoin"]["link"])
+    await send_payment_link(ctx, "litecoin")
 
-@bot.command()
+@bot.hybrid_command()
 async def sol(ctx):
     """Displays Solana address only."""
-    await ctx.send(PAYMENT_METHODS["solana"]["link"])
+    await send_payment_link(ctx, "solana")
+
+# --- Application Commands ---
+def command_tree_hash():
+    """Hash of the global application command payload, as it would be sent by tree.sync()."""
+    payload = sorted((command.to_dict(bot.tree) for command in bot.tree.get_commands()), key=lambda command: command["name"])
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+async def sync_command_tree():
+    """
+    Syncs application commands only if they changed since the last sync.
+
+    The hash of the last synced payload is kept in store meta, so ordinary
+    restarts make no bulk-overwrite call and never hit the sync rate limit.
+    """
+    tree_hash = command_tree_hash()
+    if tree_hash == await run_write(ticket_store.get_meta, "command_tree_hash"):
+        log.info("Application commands unchanged; skipping sync.")
+        return
+    try:
+        synced = await bot.tree.sync()
+    except discord.HTTPException:
+        log.exception("Failed to sync application commands")
+        return
+    store_write("command_tree", ticket_store.set_meta, "command_tree_hash", tree_hash)
+    log.info("Synced %d application commands.", len(synced))
+
+# --- Shutdown ---
+shutdown_task = None  # Task running shutdown(), once requested
+
+def request_shutdown(reason):
+    """Starts the shutdown sequence once, e.g. from a signal handler."""
+    global shutdown_task
+    if shutdown_task is None:
+        shutdown_task = asyncio.create_task(shutdown(reason))
+    return shutdown_task
+
+async def shutdown(reason):
+    """
+    Stops the bot without losing ticket state.
+
+    Running close jobs finish (queued ones resume on the next start), every
+    ticket's absolute auto-close deadline is saved, pending log posts are sent,
+    and ticket state is flushed to the store in a single transaction before the
+    gateway connection is closed.
+    """
+    log.info("Shutting down: %s", reason)
+    for task in (guild_config_watcher, transcript_archive_maintainer, ticket_timers.task):
+        if task is not None:
+            task.cancel()
+    await stop_close_workers()
+
+    if attachment_archiver:
+        await attachment_archiver.close()
+    for sink in LOG_SINKS.values():
+        await sink.close()
+
+    if ticket_store is not None:
+        deadlines = {str(channel_id): entry[0] for channel_id, entry in ticket_timers.entries.items()}
+        store_write("deadlines", ticket_store.set_meta, "auto_close_deadlines", deadlines)
+        await save_ticket_data()
+        await run_write(ticket_store.close)
+    if transcript_archive:
+        transcript_archive.executor.shutdown(wait=False)  # Queued indexing still completes before exit
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+    loop_watchdog.stop()
+    await bot.close()
+    log.info("Shutdown complete.")
+
+async def run_bot(token):
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, request_shutdown, sig.name)
+        except NotImplementedError:
+            pass  # Windows: fall back to KeyboardInterrupt
+    async with bot:
+        try:
+            await bot.start(token)
+        finally:
+            await request_shutdown("bot stopped")
 
 # --- Main Execution ---
 if __name__ == '__main__':
+    setup_logging()
     TOKEN = os.getenv("DISCORD_TOKEN")
     if TOKEN:
         try:
-            bot.run(TOKEN)
+            asyncio.run(run_bot(TOKEN))
         except discord.HTTPException as e:
             if e.code == 40041:
-                print("Error: Invalid Discord bot token. Please check your DISCORD_TOKEN environment variable.")
+                log.error("Invalid Discord bot token. Please check your DISCORD_TOKEN environment variable.")
             else:
-                print(f"An HTTP error occurred: {e}", file=sys.stderr)
-                traceback.print_exc()
-        except Exception as e:
-            print(f"An unexpected error occurred during bot execution: {e}", file=sys.stderr)
-            traceback.print_exc()
+                log.exception("An HTTP error occurred")
+        except Exception:
+            log.exception("An unexpected error occurred during bot execution")
     else:
-        print("Error: DISCORD_TOKEN environment variable not set. Please set it before running the bot.")
+        log.error("DISCORD_TOKEN environment variable not set. Please set it before running the bot.")